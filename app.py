@@ -6,6 +6,8 @@ from io import BytesIO
 from PIL import Image
 import tempfile
 from n2 import encode, decode  # Assuming your code is saved as encode_decode_module.py
+from codee import job_workspace
+from result_cache import cache_key, cached, content_hash
 
 # Streamlit UI setup
 st.title("Hybrid Encryption to GIF Converter")
@@ -32,23 +34,28 @@ if uploaded_file is not None:
     
     # Encoding the file
     output_gif_name = f"{uploaded_file.name}.gif"
-    try:
-        # Run encoding
+
+    def encode_upload():
         gif_path = encode(temp_file_path, vigenere_key=vigenere_key)
+        with open(gif_path, "rb") as gif_file:
+            return gif_file.read(), {}
+
+    try:
+        # Run encoding, or reuse the result from an earlier run on the same upload
+        result_key = cache_key("n2-encode-v3", content_hash(uploaded_file.getvalue()), vigenere_key)
+        gif_bytes, _ = cached(result_key, encode_upload)
         st.success("Encryption and GIF generation completed!")
 
         # Display the GIF in the Streamlit app
-        st.image(gif_path)
+        st.image(gif_bytes)
 
         # Provide a download button for the generated GIF
-        with open(gif_path, "rb") as gif_file:
-            gif_bytes = gif_file.read()
-            st.download_button(
-                label="Download Encrypted GIF",
-                data=gif_bytes,
-                file_name=output_gif_name,
-                mime="image/gif"
-            )
+        st.download_button(
+            label="Download Encrypted GIF",
+            data=gif_bytes,
+            file_name=output_gif_name,
+            mime="image/gif"
+        )
 
     except Exception as e:
         st.error(f"An error occurred during encryption: {e}")
@@ -62,18 +69,24 @@ if uploaded_gif is not None:
         tmp_file.write(uploaded_gif.getvalue())
         gif_file_path = tmp_file.name
 
+    def decode_upload():
+        # Decode into a directory of this job's own, so that only its file
+        # is cached and other sessions' files are neither listed nor mixed in
+        with job_workspace() as work:
+            recovered = decode(gif_file_path, vigenere_key=vigenere_key, out_dir=work)
+            with open(recovered, "rb") as f:
+                return f.read(), {"name": os.path.basename(recovered)}
+
     try:
         st.write("Decrypting GIF...")
-        decode(gif_file_path, vigenere_key=vigenere_key)
+        result_key = cache_key("n2-decode-v3", content_hash(uploaded_gif.getvalue()), vigenere_key)
+        data, meta = cached(result_key, decode_upload)
         st.success("Decryption completed!")
 
-        # Display a link or name of recovered file
-        recovered_files_path = "recovered_files"
-        recovered_files = os.listdir(recovered_files_path)
-        if recovered_files:
-            st.write("Recovered Files:")
-            for recovered_file in recovered_files:
-                st.write(recovered_file)
+        # Display the name of the recovered file and offer it for download
+        st.write("Recovered File:")
+        st.write(meta["name"])
+        st.download_button(f"Download {meta['name']}", data=data, file_name=meta["name"])
 
     except Exception as e:
         st.error(f"An error occurred during decryption: {e}")
@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import codee
+from codec_bench import best_of, parse_size, run_metadata
+
+# Throughput of every engine in codee.CIPHERS, on whole buffers and a chunk
+# at a time as encode_stream runs them:
+#   python benchmarks/cipher_bench.py -o ciphers.json
+#   python benchmarks/cipher_bench.py --ciphers shake128 --sizes 1M 128M
+
+KEY = "".join(format(ord(char), "08b") for char in "key")
+DEFAULT_SIZES = ["1K", "16K", "128K", "1M", "16M", "128M"]
+
+# Chunk size of the streamed runs, as read by encode_stream
+CHUNK = 1 << 20
+
+def streamed(cipher, data, key):
+    # encrypt() a chunk at a time, with each chunk's offset in the stream
+    return np.concatenate([cipher.encrypt(data[start:start + CHUNK], key, start)
+                           for start in range(0, data.size, CHUNK)])
+
+def run(sizes, names=tuple(codee.CIPHERS), seed=0):
+    # Throughput of the `names` engines on whole buffers and on CHUNK sized
+    # pieces, and the cost of deriving an engine key cold and cached.
+    # Prints a table and returns (engine key results, throughput results).
+    ciphers = [codee.CIPHERS[name] for name in names]
+    rng = np.random.default_rng(seed)
+    keys = {}
+    key_results = []
+    for cipher in ciphers:
+        nonce = os.urandom(cipher.nonce_size) if cipher.nonce_size else None
+        start = time.perf_counter()
+        keys[cipher.name] = cipher.engine_key(KEY, nonce)
+        cold = time.perf_counter() - start
+        cached, _ = best_of(lambda: cipher.engine_key(KEY, nonce), 5)
+        key_results.append({"cipher": cipher.name, "cold": cold, "cached": cached})
+        print(f"{cipher.name:>13} engine key: cold {cold * 1e6:8.1f}us cached {cached * 1e6:8.2f}us")
+
+    results = []
+    print(f"{'size':>10} " + " ".join(f"{name + ' whole':>20} {name + ' chunked':>22}" for name in names))
+    for size in sizes:
+        data = rng.integers(0, 256, size, dtype=np.uint8)
+        repeat = 5 if size <= (1 << 24) else 1
+        columns = []
+        for cipher in ciphers:
+            key = keys[cipher.name]
+            whole_time, whole_out = best_of(lambda: cipher.encrypt(data, key, 0), repeat)
+            chunk_time, chunk_out = best_of(lambda: streamed(cipher, data, key), repeat)
+            assert np.array_equal(whole_out, chunk_out)
+            assert np.array_equal(cipher.decrypt(whole_out, key, 0), data)
+            results.append({"cipher": cipher.name, "size": size, "whole": whole_time, "chunked": chunk_time,
+                            "whole_mb_per_s": size / whole_time / 1e6, "chunked_mb_per_s": size / chunk_time / 1e6})
+            columns.append(f"{size / whole_time / 1e6:15.1f}MB/s {size / chunk_time / 1e6:17.1f}MB/s")
+        print(f"{size:>10} " + " ".join(columns), flush=True)
+    return key_results, results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput of the codee cipher engines.")
+    parser.add_argument("--ciphers", nargs="+", choices=list(codee.CIPHERS), default=list(codee.CIPHERS))
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="generated input sizes, e.g. 1K 16M")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="cipher_bench.json")
+    args = parser.parse_args(argv)
+
+    key_results, results = run([parse_size(text) for text in args.sizes], args.ciphers, args.seed)
+    with open(args.output, "w") as f:
+        json.dump({
+            **run_metadata(args.seed),
+            "chunk": CHUNK,
+            "engine_keys": key_results,
+            "results": results,
+        }, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import codee
+
+# Benchmarks the three codecs end to end, stage by stage:
+#   codee  codee.encode and codee.decode, what main.py and the CLI run,
+#          with the stage times they report to their progress callback
+#   plain  codee's legacy pipeline with no cipher stage, the plain-bits
+#          encoder main.py started from
+#   n2     alphabetic Polybius + Vigenère on bit strings
+# Every case runs in a fresh process so its peak RSS is its own. Inputs
+# are generated from a fixed seed, so runs are comparable across commits.
+#
+#   python benchmarks/codec_bench.py -o results.json
+#   python benchmarks/codec_bench.py --sizes 1K 1M --engines codee plain
+#   python benchmarks/codec_bench.py --engines codee --cipher polybius-xor
+
+KEY = "key"
+BINARY_KEY = "".join(format(ord(char), "08b") for char in KEY)
+# codee reports "frames" for what plain and n2 split into pixelize,
+# frame_write and gif_assemble
+STAGES = ["read", "cipher", "frames", "pixelize", "frame_write", "gif_assemble", "decode"]
+RESOLUTIONS = {"hd": codee.HD, "4k": codee.four_k}
+DEFAULT_SIZES = ["1K", "64K", "1M", "16M", "256M", "1G"]
+
+# n2 works on Python lists of "0"/"1" strings and runs at well under
+# 1 MB/s, so by default it only gets the small inputs
+N2_LIMIT = 1 << 20
+
+def parse_size(text):
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if text[-1].upper() in units:
+        return int(text[:-1]) * units[text[-1].upper()]
+    return int(text)
+
+def best_of(fn, repeat):
+    # Fastest of `repeat` calls, with the last call's result
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def run_metadata(seed):
+    # What every benchmark writes next to its results
+    return {
+        "seed": seed,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def make_input(path, size, seed):
+    # Random bytes written in pieces, so a 1 GB input never sits in memory
+    rng = np.random.default_rng(seed)
+    with open(path, "wb") as f:
+        left = size
+        while left:
+            piece = min(left, 1 << 24)
+            rng.integers(0, 256, piece, dtype=np.uint8).tofile(f)
+            left -= piece
+
+@contextlib.contextmanager
+def timed(times, stage):
+    # Adds the wall time of the block to times[stage]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        times[stage] = times.get(stage, 0.0) + time.perf_counter() - start
+
+def codee_encode(src, res, times, cipher):
+    # encode itself, timed stage by stage through its progress callback
+    def progress(event):
+        if event.event == "end":
+            times[event.stage] = times.get(event.stage, 0.0) + event.elapsed
+    return codee.encode(src, BINARY_KEY, res, progress=progress, cipher=cipher)
+
+def plain_encode(src, res, times):
+    # The legacy layout with no cipher, split into its stages. Frames are
+    # rendered and compressed one at a time, as encode does, while the GIF
+    # file is written.
+    with timed(times, "read"):
+        bits = codee.add_header(codee.file_2_bits(src), os.path.basename(src))
+
+    def frames():
+        chunks = codee.iter_frame_bits([bits], res)
+        while True:
+            # Cutting the stream into frames counts as pixelizing
+            with timed(times, "pixelize"):
+                chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                values = codee.frame_values(chunk)
+            with timed(times, "frame_write"):
+                frame = codee.gif_frame(values, res, 1)
+            yield frame
+
+    target = f"{os.path.basename(src)}.gif"
+    start = time.perf_counter()
+    codee.write_gif(frames(), res, 1, target)
+    total = time.perf_counter() - start
+    times["gif_assemble"] = total - times.get("pixelize", 0) - times.get("frame_write", 0)
+    return target
+
+def plain_decode(gif):
+    fields, chunks = codee.split_preamble(codee.iter_gif_frames(gif))
+    fname, payload, _ = codee.split_header(chunks, codee.preamble_digest_size(fields))
+    os.makedirs("recovered_files", exist_ok=True)
+    target = os.path.join("recovered_files", f"{fname}-recovered")
+    codee.stream_bits_2_file(payload, target)
+    return target
+
+def n2_encode(src, res, times):
+    # n2.encode, split into its stages, with frames on `res` sized canvases
+    import n2
+    with timed(times, "read"):
+        bits = n2.add_header(n2.file_2_bits(src), os.path.basename(src))
+    with timed(times, "cipher"):
+        letters = n2.nibble_encrypt(n2.bits_2_letters("".join(bits)), "SECRET")
+        encrypted = list(n2.cipher_2_bits(n2.hybrid_encrypt(letters, "SECRET")))
+    with timed(times, "pixelize"):
+        pixels = n2.bits_2_pixels(encrypted)
+    with timed(times, "frame_write"):
+        per_frame = res[0] * res[1]
+        os.makedirs("temp", exist_ok=True)
+        for i in range(0, len(pixels), per_frame):
+            n2.pixels_2_png(pixels[i:i + per_frame], f"temp/{os.path.basename(src)}-{i // per_frame}.png", reso=res)
+    with timed(times, "gif_assemble"):
+        return n2.make_gif("temp", os.path.basename(src))
+
+def n2_decode(gif):
+    import n2
+    n2.decode(gif, "SECRET")
+    return os.path.join("recovered_files", os.listdir("recovered_files")[0])
+
+def run_case(case):
+    # One (engine, input, resolution, cipher) measurement, run in its own
+    # process; the cipher is codee's
+    engine, src, res, cipher = case
+    times = {}
+    result = {"engine": engine, "input": os.path.basename(src), "size": os.path.getsize(src),
+              "res": list(res), "stages": times}
+    if engine == "codee":
+        result["cipher"] = cipher
+    work = tempfile.mkdtemp(prefix="codec_bench-")
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        # The codecs print per-call progress; keep it out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            if engine == "n2":
+                gif = n2_encode(src, res, times)
+            elif engine == "plain":
+                gif = plain_encode(src, res, times)
+            else:
+                gif = codee_encode(src, res, times, cipher)
+            result["output_size"] = os.path.getsize(gif)
+            result["frames"] = len(codee.scan_gif(gif)[1])
+            with timed(times, "decode"):
+                if engine == "codee":
+                    recovered = codee.decode(gif, BINARY_KEY)
+                elif engine == "plain":
+                    recovered = plain_decode(gif)
+                else:
+                    recovered = n2_decode(gif)
+        result["roundtrip"] = _same_file(src, recovered)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+    result["wall"] = sum(times.values())
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    result["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return result
+
+def _same_file(a, b):
+    if os.path.getsize(a) != os.path.getsize(b):
+        return False
+    with open(a, "rb") as fa, open(b, "rb") as fb:
+        while True:
+            x, y = fa.read(1 << 24), fb.read(1 << 24)
+            if x != y:
+                return False
+            if not x:
+                return True
+
+def isolated(case):
+    # A fresh process per case; spawn so no memory is inherited
+    with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(run_case, case).result()
+
+def report(result):
+    stages = " ".join(f"{stage}={result['stages'][stage]:.3f}" for stage in STAGES if stage in result["stages"])
+    mbps = result["size"] / max(result["wall"], 1e-9) / 1e6
+    status = result.get("error") or ("ok" if result.get("roundtrip") else "MISMATCH")
+    print(f"{result['engine']:>5} {result['input']:>16} {result['res'][0]}x{result['res'][1]} "
+          f"{result['wall']:8.3f}s {mbps:8.2f}MB/s rss={result['peak_rss'] / 1e6:7.1f}MB "
+          f"out={result.get('output_size', 0)} {stages} [{status}]", flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stage-by-stage benchmark of the codee, plain and n2 codecs.")
+    parser.add_argument("--engines", nargs="+", choices=["codee", "plain", "n2"], default=["codee", "plain", "n2"])
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="generated input sizes, e.g. 1K 16M 1G")
+    parser.add_argument("--res", nargs="+", choices=sorted(RESOLUTIONS), default=["hd", "4k"])
+    parser.add_argument("--no-samples", action="store_true", help="skip the files in data/")
+    parser.add_argument("--n2-limit", type=parse_size, default=N2_LIMIT, help="largest input n2 is run on")
+    parser.add_argument("--cipher", choices=list(codee.CIPHERS), default=codee.DEFAULT_CIPHER,
+                        help=f"cipher of the codee engine (default {codee.DEFAULT_CIPHER})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="codec_bench.json")
+    args = parser.parse_args(argv)
+
+    inputs_dir = tempfile.mkdtemp(prefix="codec_bench-inputs-")
+    try:
+        inputs = []
+        for text in args.sizes:
+            size = parse_size(text)
+            path = os.path.join(inputs_dir, f"random-{text}.bin")
+            make_input(path, size, args.seed)
+            inputs.append(path)
+        if not args.no_samples:
+            data = os.path.join(REPO, "data")
+            inputs += [os.path.join(data, name) for name in sorted(os.listdir(data))]
+
+        results = []
+        for src in inputs:
+            for res in args.res:
+                for engine in args.engines:
+                    if engine == "n2" and os.path.getsize(src) > args.n2_limit:
+                        continue
+                    result = isolated((engine, src, RESOLUTIONS[res], args.cipher))
+                    report(result)
+                    results.append(result)
+    finally:
+        shutil.rmtree(inputs_dir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump({**run_metadata(args.seed), "cipher": args.cipher, "results": results}, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import codee
+from codec_bench import _same_file, make_input, parse_size, run_metadata
+
+# Encode and decode throughput and output size of every container backend
+# at every density it supports, to choose the fastest one for internal
+# transfers (GIF stays the default for compatibility):
+#   python benchmarks/container_bench.py -o containers.json
+#   python benchmarks/container_bench.py --containers gif png --densities 8 --sizes 16M
+# Inputs are random bytes from a fixed seed, like encrypted payloads, so
+# runs are comparable across commits.
+
+KEY = "key"
+BINARY_KEY = "".join(format(ord(char), "08b") for char in KEY)
+DEFAULT_SIZES = ["64K", "4M", "32M"]
+
+def run_case(container, density, src, res, workers, work):
+    target = os.path.join(work, f"out{codee.CONTAINERS[container].suffix}")
+    start = time.perf_counter()
+    codee.encode_stream(src, BINARY_KEY, res, target=target, density=density, workers=workers, container=container)
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    recovered = codee.decode(target, BINARY_KEY, workers=workers, out_dir=os.path.join(work, "recovered"))
+    decode_time = time.perf_counter() - start
+    size = os.path.getsize(src)
+    return {
+        "container": container,
+        "density": density,
+        "size": size,
+        "output_size": os.path.getsize(target),
+        "frames": len(codee.scan_frames(target)[1]),
+        "encode": encode_time,
+        "decode": decode_time,
+        "encode_mb_per_s": size / max(encode_time, 1e-9) / 1e6,
+        "decode_mb_per_s": size / max(decode_time, 1e-9) / 1e6,
+        "roundtrip": _same_file(src, recovered),
+    }
+
+def report(result):
+    print(f"{result['container']:>5} d={result['density']:<2} {result['size']:>10} "
+          f"enc {result['encode']:8.3f}s {result['encode_mb_per_s']:8.2f}MB/s "
+          f"dec {result['decode']:8.3f}s {result['decode_mb_per_s']:8.2f}MB/s "
+          f"out={result['output_size']} ({result['output_size'] / max(result['size'], 1):.3f}x) "
+          f"frames={result['frames']} [{'ok' if result['roundtrip'] else 'MISMATCH'}]", flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput and size of the codee container backends.")
+    parser.add_argument("--containers", nargs="+", choices=list(codee.CONTAINERS), default=list(codee.CONTAINERS))
+    parser.add_argument("--densities", nargs="+", type=int, default=[1, 8, 24],
+                        help="bits per pixel; each container runs the ones it supports")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="generated input sizes, e.g. 64K 16M")
+    parser.add_argument("--res", default="auto", help="frame size: auto or WIDTHxHEIGHT")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="processes per encode/decode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="container_bench.json")
+    args = parser.parse_args(argv)
+    res = args.res if args.res == codee.AUTO_RES else tuple(int(side) for side in args.res.lower().split("x"))
+
+    work = tempfile.mkdtemp(prefix="container_bench-")
+    results = []
+    try:
+        for text in args.sizes:
+            src = os.path.join(work, f"random-{text}.bin")
+            make_input(src, parse_size(text), args.seed)
+            for container in args.containers:
+                for density in args.densities:
+                    if density not in codee.CONTAINERS[container].densities:
+                        continue
+                    result = run_case(container, density, src, res, args.workers, work)
+                    report(result)
+                    results.append(result)
+            os.remove(src)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump({**run_metadata(args.seed), "res": args.res, "workers": args.workers, "results": results},
+                  f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+if __name__ == "__main__":
+    main()
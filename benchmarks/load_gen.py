@@ -0,0 +1,165 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from codec_bench import parse_size, run_metadata
+from server import percentile
+
+# Load generator for server.py. For every file size, `--concurrency`
+# clients each hold one kept-alive connection and send encode requests
+# (or encode followed by decode of the returned image, with --roundtrip)
+# until `--requests` have been made, then p50/p99 latency and requests per
+# second are reported and written as JSON:
+#   python benchmarks/load_gen.py --spawn --sizes 1K 64K 1M -c 4 -n 40
+#   python benchmarks/load_gen.py --url http://127.0.0.1:8080 --roundtrip
+# --spawn starts a server on a free port for the run and stops it after.
+# Inputs are random bytes from a fixed seed, so runs are comparable.
+
+KEY = "key"
+DEFAULT_SIZES = ["1K", "64K", "1M", "4M"]
+
+def request(conn, method, path, body=b"", headers=None):
+    # Returns (status, response body); the connection stays open
+    conn.request(method, path, body=body, headers={"X-Key": KEY, **(headers or {})})
+    response = conn.getresponse()
+    return response.status, response.read()
+
+def client(url, path, payload, roundtrip, todo, latencies, errors, lock):
+    # One kept-alive connection; takes requests off `todo` until it's empty
+    host = urlsplit(url)
+    conn = http.client.HTTPConnection(host.hostname, host.port, timeout=600)
+    try:
+        while True:
+            with lock:
+                if todo[0] <= 0:
+                    return
+                todo[0] -= 1
+            start = time.perf_counter()
+            try:
+                status, gif = request(conn, "POST", path, payload)
+                if status == 200 and roundtrip:
+                    status, data = request(conn, "POST", "/decode", gif)
+                    if status == 200 and data != payload:
+                        status = "mismatch"
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                conn.close()
+            seconds = time.perf_counter() - start
+            with lock:
+                if status == 200:
+                    latencies.append(seconds)
+                else:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+    finally:
+        conn.close()
+
+def run_size(url, size, args, seed):
+    payload = np.random.default_rng(seed).integers(0, 256, size, dtype=np.uint8).tobytes()
+    path = f"/encode?name=load-{size}.bin&res={args.res}&density={args.density}&container={args.container}"
+    latencies, errors, lock = [], {}, threading.Lock()
+    todo = [args.requests]
+    threads = [threading.Thread(target=client, args=(url, path, payload, args.roundtrip, todo, latencies, errors, lock))
+               for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    return {
+        "size": size,
+        "requests": args.requests,
+        "ok": len(latencies),
+        "errors": errors,
+        "wall": wall,
+        "rps": len(latencies) / wall,
+        "mb_per_s": len(latencies) * size / wall / 1e6,
+        "p50_ms": (percentile(latencies, 0.5) or 0) * 1e3,
+        "p99_ms": (percentile(latencies, 0.99) or 0) * 1e3,
+    }
+
+def spawn_server(jobs):
+    # server.py on a free port; returns (process, url) once it answers
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    command = [sys.executable, os.path.join(REPO, "server.py"), "--port", str(port)]
+    if jobs:
+        command += ["--jobs", str(jobs)]
+    process = subprocess.Popen(command, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            request(conn, "GET", "/health")
+            conn.close()
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("server.py did not start")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latency and throughput of server.py under concurrent load.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--spawn", action="store_true", help="start a server.py for the run")
+    parser.add_argument("--jobs", type=int, help="--jobs for the spawned server")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="upload sizes, e.g. 1K 1M")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="clients sending at once")
+    parser.add_argument("-n", "--requests", type=int, default=20, help="requests per size")
+    parser.add_argument("--res", default="auto", help="frame size: auto, 4k, hd or WIDTHxHEIGHT")
+    parser.add_argument("--density", type=int, default=1)
+    parser.add_argument("--container", default="gif", help="gif, apng, png or webp")
+    parser.add_argument("--roundtrip", action="store_true", help="decode every image and compare")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="load_gen.json")
+    args = parser.parse_args(argv)
+
+    process = None
+    url = args.url
+    if args.spawn:
+        process, url = spawn_server(args.jobs)
+    try:
+        results = []
+        for text in args.sizes:
+            result = run_size(url, parse_size(text), args, args.seed)
+            errors = " ".join(f"{status}x{count}" for status, count in result["errors"].items()) or "none"
+            print(f"{text:>6} {result['ok']:4d}/{result['requests']} ok {result['rps']:8.2f} req/s "
+                  f"{result['mb_per_s']:8.2f} MB/s p50={result['p50_ms']:9.1f}ms p99={result['p99_ms']:9.1f}ms "
+                  f"errors: {errors}", flush=True)
+            results.append(result)
+        conn = http.client.HTTPConnection(urlsplit(url).hostname, urlsplit(url).port)
+        _, health = request(conn, "GET", "/health")
+        conn.close()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    with open(args.output, "w") as f:
+        json.dump({
+            **run_metadata(args.seed),
+            "url": url,
+            "concurrency": args.concurrency,
+            "res": args.res,
+            "density": args.density,
+            "container": args.container,
+            "roundtrip": args.roundtrip,
+            "results": results,
+            "server": json.loads(health),
+        }, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import random
+import string
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import n2
+from codec_bench import best_of, parse_size, run_metadata
+
+# Throughput of n2's Polybius + Vigenère table engine against the
+# per-character implementation it replaced, on single texts and on a batch
+# of short ones, after checking that the two agree:
+#   python benchmarks/n2_cipher_bench.py -o n2_cipher.json
+#   python benchmarks/n2_cipher_bench.py --sizes 1K 1M --batch 1000
+
+KEY = "SECRET"
+DEFAULT_SIZES = ["1K", "16K", "128K", "1M", "4M", "64M"]
+
+# Largest input the per-character implementation is timed on by default
+CHAR_LIMIT = 1 << 22
+
+# The per-character implementation the table engine replaced
+def char_vigenere_encrypt(text, key):
+    encrypted = []
+    key = key.upper()
+    for i, char in enumerate(text):
+        if char.isalpha():
+            shift = ord(key[i % len(key)]) - ord('A')
+            encrypted_char = chr(((ord(char) - ord('A') + shift) % 26) + ord('A'))
+            encrypted.append(encrypted_char)
+        else:
+            encrypted.append(char)
+    return ''.join(encrypted)
+
+def char_vigenere_decrypt(text, key):
+    decrypted = []
+    key = key.upper()
+    for i, char in enumerate(text):
+        if char.isalpha():
+            shift = ord(key[i % len(key)]) - ord('A')
+            decrypted_char = chr(((ord(char) - ord('A') - shift + 26) % 26) + ord('A'))
+            decrypted.append(decrypted_char)
+        else:
+            decrypted.append(char)
+    return ''.join(decrypted)
+
+def char_hybrid_encrypt(plaintext, vigenere_key):
+    polybius_encrypted = ''.join(n2.polybius_square.get(char.upper(), '') for char in plaintext
+                                 if char.upper() in n2.polybius_square)
+    return char_vigenere_encrypt(polybius_encrypted, vigenere_key)
+
+def char_hybrid_decrypt(encrypted_text, vigenere_key):
+    vigenere_decrypted = char_vigenere_decrypt(encrypted_text, vigenere_key)
+    return ''.join(n2.inverse_polybius_square.get(vigenere_decrypted[i:i+2], '')
+                   for i in range(0, len(vigenere_decrypted), 2))
+
+def make_text(size, rng, alphabet=string.ascii_letters + string.digits + string.punctuation + " \n"):
+    return "".join(rng.choices(alphabet, k=size))
+
+def check(rng):
+    # The table engine gives the same output as the per-character one,
+    # non-ASCII text and odd keys included, and binary data round-trips
+    # with its key and not with another
+    texts = [make_text(n, rng) for n in (0, 1, 7, 1000)]
+    texts += [make_text(500, rng, string.ascii_letters + "ıſßÄéΩ 12"), "24" * 9 + "1", "ÄB2411é5"]
+    for key in ("SECRET", "key", "Zz9", "ß"):
+        for text in texts:
+            assert n2.vigenere_encrypt(text, key) == char_vigenere_encrypt(text, key)
+            assert n2.vigenere_decrypt(text, key) == char_vigenere_decrypt(text, key)
+            assert n2.hybrid_encrypt(text, key) == char_hybrid_encrypt(text, key)
+            assert n2.hybrid_decrypt(text, key) == char_hybrid_decrypt(text, key)
+        assert n2.hybrid_encrypt_batch(texts, key) == [char_hybrid_encrypt(text, key) for text in texts]
+        assert n2.hybrid_decrypt_batch(texts, key) == [char_hybrid_decrypt(text, key) for text in texts]
+    def binary_roundtrip(bits, key):
+        cipher = n2.hybrid_encrypt(n2.nibble_encrypt(n2.bits_2_letters(bits), KEY), KEY)
+        letters = n2.hybrid_decrypt(n2.bits_2_cipher(n2.cipher_2_bits(cipher)), key)
+        return n2.letters_2_bits(n2.nibble_decrypt(letters, key))
+    for nbits in (0, 1, 4, 13, 8000):
+        bits = "".join(rng.choices("01", k=nbits))
+        back = binary_roundtrip(bits, KEY)
+        assert back[:nbits] == bits and set(back[nbits:]) <= {"0"}
+        assert binary_roundtrip(bits, KEY.lower()) == back
+        if nbits >= 64:
+            for key in ("XYZ", "SECRES", "A"):
+                assert binary_roundtrip(bits, key)[:nbits] != bits
+
+def run(sizes, batch=10000, batch_size=64, char_limit=CHAR_LIMIT, seed=0):
+    # Prints a row per size and the batch timings; returns (results, batch
+    # result)
+    rng = random.Random(seed)
+    check(rng)
+    results = []
+    print(f"{'size':>10} {'char enc':>13} {'table enc':>13} {'char dec':>13} {'table dec':>13} {'speedup':>9}")
+    for size in sizes:
+        text = make_text(size, rng)
+        repeat = 5 if size <= (1 << 20) else 1
+        enc_time, encrypted = best_of(lambda: n2.hybrid_encrypt(text, KEY), repeat)
+        dec_time, _ = best_of(lambda: n2.hybrid_decrypt(encrypted, KEY), repeat)
+        result = {"size": size, "table_encrypt": enc_time, "table_decrypt": dec_time,
+                  "char_encrypt": None, "char_decrypt": None}
+        if size <= char_limit:
+            char_enc, char_encrypted = best_of(lambda: char_hybrid_encrypt(text, KEY), 1)
+            char_dec, _ = best_of(lambda: char_hybrid_decrypt(char_encrypted, KEY), 1)
+            assert char_encrypted == encrypted
+            result.update(char_encrypt=char_enc, char_decrypt=char_dec)
+            columns = (f"{size / char_enc / 1e6:9.2f}MB/s", f"{size / enc_time / 1e6:9.1f}MB/s",
+                       f"{size / char_dec / 1e6:9.2f}MB/s", f"{size / dec_time / 1e6:9.1f}MB/s",
+                       f"{(char_enc + char_dec) / (enc_time + dec_time):8.0f}x")
+        else:
+            columns = (f"{'-':>13}", f"{size / enc_time / 1e6:9.1f}MB/s",
+                       f"{'-':>13}", f"{size / dec_time / 1e6:9.1f}MB/s", f"{'-':>9}")
+        print(f"{size:>10} " + " ".join(columns), flush=True)
+        results.append(result)
+
+    # Many short texts: one call per text against one batch call
+    texts = [make_text(batch_size, rng) for _ in range(batch)]
+    char_time, expected = best_of(lambda: [char_hybrid_encrypt(text, KEY) for text in texts], 1)
+    single_time, single = best_of(lambda: [n2.hybrid_encrypt(text, KEY) for text in texts], 3)
+    batch_time, batched = best_of(lambda: n2.hybrid_encrypt_batch(texts, KEY), 3)
+    assert expected == single == batched
+    print(f"{batch} texts of {batch_size}: char {batch / char_time:10.0f}/s  table {batch / single_time:10.0f}/s  "
+          f"batch {batch / batch_time:10.0f}/s")
+    return results, {"texts": batch, "text_size": batch_size, "char": char_time, "table": single_time,
+                     "batch": batch_time}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput of the n2 Polybius + Vigenère cipher engine.")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="generated text sizes, e.g. 1K 16M")
+    parser.add_argument("--char-limit", type=parse_size, default=CHAR_LIMIT,
+                        help="largest text the per-character implementation is run on")
+    parser.add_argument("--batch", type=int, default=10000, help="number of short texts in the batch run")
+    parser.add_argument("--batch-size", type=int, default=64, help="size of each text in the batch run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="n2_cipher_bench.json")
+    args = parser.parse_args(argv)
+
+    results, batch = run([parse_size(text) for text in args.sizes], args.batch, args.batch_size, args.char_limit,
+                         args.seed)
+    with open(args.output, "w") as f:
+        json.dump({
+            **run_metadata(args.seed),
+            "key": KEY,
+            "results": results,
+            "batch": batch,
+        }, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+if __name__ == "__main__":
+    main()
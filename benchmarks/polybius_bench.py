@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import codee
+from codec_bench import best_of, parse_size, run_metadata
+
+# Throughput of the binary Polybius + XOR stages: the list-of-strings
+# implementation, the table engine and the fused pass encode runs:
+#   python benchmarks/polybius_bench.py -o polybius.json
+#   python benchmarks/polybius_bench.py --sizes 1K 1M 16M
+
+KEY = "".join(format(ord(char), "08b") for char in "key")
+DEFAULT_SIZES = ["1K", "16K", "128K", "1M", "16M", "128M"]
+
+# Largest input the string implementation is timed on by default; it runs
+# at well under 1 MB/s, so bigger sizes only report the table engine
+STRING_LIMIT = 1 << 20
+
+def string_polybius_cipher_binary(data):
+    # The list-of-strings implementation the table engine replaced
+    polybius_square = {
+        "00": "11", "01": "10", "10": "01", "11": "00"
+    }
+    encrypted_data = ""
+    for i in range(0, len(data) - 1, 2):
+        pair = ''.join(data[i:i+2])
+        encrypted_data += polybius_square.get(pair, "")
+    return encrypted_data
+
+def string_vigenere_encrypt(data, key):
+    repeated_key = (key * (len(data) // len(key) + 1))[:len(data)]
+    return ''.join(
+        str(int(bit) ^ int(repeated_key[i])) for i, bit in enumerate(data)
+    )
+
+def run(sizes, string_limit=STRING_LIMIT, seed=0):
+    # Prints a row per size and returns the results
+    rng = np.random.default_rng(seed)
+    results = []
+    print(f"{'size':>10} {'string':>13} {'table':>13} {'fused':>13} {'speedup':>9}")
+    for size in sizes:
+        data = rng.integers(0, 256, size, dtype=np.uint8)
+        bits = codee.Bits(data, size * 8)
+        repeat = 5 if size <= (1 << 24) else 1
+
+        table_time, table_out = best_of(
+            lambda: codee.binary_vigenere_encrypt(codee.polybius_cipher_binary(bits), KEY), repeat)
+        fused_time, fused_out = best_of(lambda: codee.binary_hybrid_encrypt(bits, KEY), repeat)
+        assert np.array_equal(table_out.data, fused_out.data)
+
+        result = {"size": size, "table": table_time, "fused": fused_time, "string": None,
+                  "table_mb_per_s": size / table_time / 1e6, "fused_mb_per_s": size / fused_time / 1e6}
+        if size <= string_limit:
+            bitstr = codee.bits_2_str(bits)
+            string_time, string_out = best_of(
+                lambda: string_vigenere_encrypt(string_polybius_cipher_binary(list(bitstr)), KEY), 1)
+            assert string_out == codee.bits_2_str(fused_out)
+            result["string"] = string_time
+            string_col = f"{size / string_time / 1e6:9.2f}MB/s"
+            speedup = f"{string_time / fused_time:8.0f}x"
+        else:
+            string_col = f"{'-':>13}"
+            speedup = f"{'-':>9}"
+        print(f"{size:>10} {string_col} {size / table_time / 1e6:9.1f}MB/s "
+              f"{size / fused_time / 1e6:9.1f}MB/s {speedup}", flush=True)
+        results.append(result)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput of the binary Polybius + XOR cipher stages.")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="generated input sizes, e.g. 1K 16M")
+    parser.add_argument("--string-limit", type=parse_size, default=STRING_LIMIT,
+                        help="largest input the string implementation is run on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="polybius_bench.json")
+    args = parser.parse_args(argv)
+
+    results = run([parse_size(text) for text in args.sizes], args.string_limit, args.seed)
+    with open(args.output, "w") as f:
+        json.dump({**run_metadata(args.seed), "results": results}, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+if __name__ == "__main__":
+    main()
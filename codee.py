@@ -1,14 +1,335 @@
 
-from PIL import Image
+from PIL import GifImagePlugin, Image
 import binascii
+import hashlib
+import hmac
 import imageio.v2 as imageio  
+import io
+import itertools
+import lzma
+import math
+import mmap
+import numpy as np
 import os
+import re
+import struct
 import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from shutil import rmtree
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 four_k = (3840, 2160)
 HD = (1920, 1080)
 
+# res="auto" picks the frame size from the payload: square frames just big
+# enough for small files, and for large ones frames AUTO_MAX_WIDTH wide and
+# as tall as AUTO_MAX_PIXELS allows, so they need fewer frames. GIF sides
+# are at most GIF_MAX_SIDE pixels.
+AUTO_RES = "auto"
+AUTO_MAX_WIDTH = 4096
+AUTO_MAX_PIXELS = 1 << 24
+GIF_MAX_SIDE = 65535
+
+# Bits stored per pixel. GIF frames are palette images and hold up to 8;
+# 24 packs three bytes into an RGB pixel for lossless RGB containers.
+DENSITIES = (1, 2, 4, 8, 24)
+GIF_DENSITIES = (1, 2, 4, 8)
+
+# A bit stream packed MSB-first into a uint8 array. Bits past `nbits` in the
+# last byte are always zero so streams can be compared and joined bytewise.
+Bits = namedtuple("Bits", ["data", "nbits"])
+
+# What encode and decode pass to a `progress` callback. `event` is "start",
+# "progress" (once per frame), "end" or "error"; `frames` and `nbytes` are
+# the frames and bytes handled so far in the stage, `total_frames` the
+# number expected (None if unknown) and `elapsed` the seconds since the
+# stage started.
+Progress = namedtuple("Progress", ["stage", "event", "frames", "total_frames", "nbytes", "elapsed"])
+
+def _ignore(*args):
+    pass
+
+@contextmanager
+def progress_stage(progress, stage, total_frames=None):
+    # Report the start and end of a stage to `progress`, or do nothing if
+    # it is None. The body gets a function to call with the frames and
+    # bytes done so far.
+    if progress is None:
+        yield _ignore
+        return
+    start = time.perf_counter()
+    done = [0, 0]
+
+    def report(frames, nbytes):
+        done[:] = frames, nbytes
+        progress(Progress(stage, "progress", frames, total_frames, nbytes, time.perf_counter() - start))
+
+    progress(Progress(stage, "start", 0, total_frames, 0, 0.0))
+    try:
+        yield report
+    except BaseException:
+        progress(Progress(stage, "error", done[0], total_frames, done[1], time.perf_counter() - start))
+        raise
+    progress(Progress(stage, "end", done[0], total_frames, done[1], time.perf_counter() - start))
+
+def _reported(items, report, nbytes_of):
+    # Pass `items` through, reporting each one as a frame
+    frames = nbytes = 0
+    for item in items:
+        frames += 1
+        nbytes += nbytes_of(item)
+        report(frames, nbytes)
+        yield item
+
+def _mask_tail(data, nbits):
+    rem = nbits % 8
+    if rem and data.size:
+        data[-1] &= (0xFF << (8 - rem)) & 0xFF
+    return data
+
+def str_2_bits(bitstr):
+    digits = np.frombuffer(bitstr.encode("ascii"), dtype=np.uint8) - ord("0")
+    return Bits(np.packbits(digits), len(bitstr))
+
+def bits_2_str(bits):
+    digits = np.unpackbits(bits.data, count=bits.nbits) + ord("0")
+    return digits.tobytes().decode("ascii")
+
+def join_bits(parts):
+    total = sum(p.nbits for p in parts)
+    nbytes = (total + 7) // 8
+    out = np.zeros(nbytes + 1, dtype=np.uint8)
+    pos = 0
+    for p in parts:
+        byte, shift = divmod(pos, 8)
+        n = (p.nbits + 7) // 8
+        chunk = p.data[:n]
+        if shift:
+            out[byte:byte + n] |= chunk >> shift
+            out[byte + 1:byte + n + 1] |= chunk << (8 - shift)
+        else:
+            out[byte:byte + n] |= chunk
+        pos += p.nbits
+    return Bits(out[:nbytes], total)
+
+def slice_bits(bits, start, length):
+    length = max(0, min(length, bits.nbits - start))
+    byte, shift = divmod(start, 8)
+    nbytes = (length + 7) // 8
+    if shift:
+        chunk = np.append(bits.data[byte:byte + nbytes + 1], np.uint8(0))
+        data = (chunk[:nbytes] << shift) | (chunk[1:nbytes + 1] >> (8 - shift))
+    else:
+        data = bits.data[byte:byte + nbytes].copy()
+    return Bits(_mask_tail(data, length), length)
+
+def align_bits(chunks):
+    # Re-cut a stream of Bits chunks so every piece holds whole bytes,
+    # except possibly the last
+    carry = Bits(np.zeros(0, dtype=np.uint8), 0)
+    for chunk in chunks:
+        stream = join_bits([carry, chunk]) if carry.nbits else chunk
+        whole = stream.nbits // 8
+        if whole:
+            yield Bits(stream.data[:whole], whole * 8)
+        carry = slice_bits(stream, whole * 8, stream.nbits % 8)
+    if carry.nbits:
+        yield carry
+
+def take_bits(chunks, nbits):
+    # The first `nbits` bits of a stream of Bits chunks
+    if nbits <= 0:
+        return
+    for chunk in chunks:
+        if chunk.nbits > nbits:
+            chunk = slice_bits(chunk, 0, nbits)
+        nbits -= chunk.nbits
+        yield chunk
+        # Stop without pulling another chunk from upstream
+        if nbits <= 0:
+            break
+
+def frames_2_gif(frames, target):
+    # `target` is a filename or a writable file object
+    with imageio.get_writer(target, format="GIF", mode="I", duration=0.1) as writer:
+        for frame in frames:
+            writer.append_data(frame)
+    return target
+
+def _gif_lzw(indices, reso, code_size):
+    # LZW-compress one frame of palette indices into GIF data sub-blocks,
+    # using Pillow's C encoder with the given minimum code size
+    im = Image.frombuffer("P", reso, indices, "raw", "P", 0, 1)
+    encoder = Image._getencoder("P", "gif", ("P", code_size, 0))
+    encoder.setimage(im.im, (0, 0) + reso)
+    blocks = []
+    while True:
+        _, status, data = encoder.encode(1 << 20)
+        blocks.append(data)
+        if status:
+            break
+    if status < 0:
+        raise OSError(f"GIF encoder error {status}")
+    return b"".join(blocks)
+
+def gif_frame(values, reso, density):
+    # One encoded GIF frame for a frame of pixel values: the graphic control
+    # extension (100 ms), the image descriptor without a local colour table
+    # and the LZW data. A frame with fewer values than `reso` holds (the
+    # last one) is trimmed to the rows it uses; pixels past the end of
+    # `values` in its last row are 0.
+    code_size = max(2, density)
+    reso = (reso[0], min(reso[1], max(1, -(-len(values) // reso[0]))))
+    indices = np.zeros(reso[0] * reso[1], dtype=np.uint8)
+    indices[:len(values)] = values
+    return b"".join([
+        b"!\xf9\x04\x00" + struct.pack("<H", 10) + b"\x00\x00",
+        b"," + struct.pack("<HHHHB", 0, 0, reso[0], reso[1], 0) + bytes([code_size]),
+        _gif_lzw(indices, reso, code_size),
+        b"\x00",
+    ])
+
+def write_gif(frames, reso, density, target):
+    # Write encoded frames from gif_frame to a GIF as they arrive. The
+    # global colour table holds 2**density greys, so pixel values are
+    # palette indices and nothing is quantized. `target` is a filename or a
+    # writable file object.
+    _check_gif_density(density)
+    _check_res(reso)
+    table_bits = max(1, density)
+    width, height = reso
+    fp = open(target, "wb") if isinstance(target, str) else target
+    try:
+        fp.write(b"GIF89a" + struct.pack(
+            "<HHBBB", width, height, 0x80 | (table_bits - 1) << 4 | (table_bits - 1), 0, 0))
+        fp.write(density_palette(table_bits).tobytes())
+        # Loop forever
+        fp.write(b"!\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+        for frame in frames:
+            fp.write(frame)
+        fp.write(b";")
+    finally:
+        if fp is not target:
+            fp.close()
+    return target
+
+def ordered_pool_map(fn, items, workers=None):
+    # Like map(fn, items), but with `fn` running in a pool of `workers`
+    # processes (None for one per CPU). Results come back in order, and at
+    # most two jobs per worker are in flight, so `items` can be a long
+    # stream.
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(fn, item))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # A consumer that stops early doesn't wait for queued jobs
+            for future in pending:
+                future.cancel()
+
+# Where one image of a GIF sits in the file and what decoding it needs.
+# `whole` is set for opaque images at the top left as wide as the logical
+# screen, which can be decoded without the frames before them: full
+# frames, and last frames trimmed to the rows they use.
+GifImage = namedtuple("GifImage", ["offset", "length", "size", "code_size", "interlace", "palette", "whole"])
+
+def _gif_palette(table):
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    colours = np.frombuffer(table, dtype=np.uint8).reshape(-1, 3)
+    palette[:len(colours)] = colours
+    return palette
+
+def _skip_sub_blocks(data, pos):
+    while data[pos]:
+        pos += data[pos] + 1
+    return pos + 1
+
+@contextmanager
+def file_bytes(src):
+    # The bytes of an encoded file, memory-mapped, or of an in-memory one
+    # from encode(in_memory=True)
+    if isinstance(src, io.BytesIO):
+        yield src.getvalue()
+        return
+    with open(src, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            # mmap refuses empty files
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+def scan_gif(src):
+    # Walk the block structure of a GIF without decompressing anything.
+    # Returns the logical screen size and a GifImage for every image.
+    images = []
+    with file_bytes(src) as data:
+        if data[:3] != b"GIF":
+            raise ValueError(f"{src} is not a GIF file")
+        width, height, flags = struct.unpack("<HHB", data[6:11])
+        pos = 13
+        global_palette = None
+        if flags & 0x80:
+            table_size = 3 * (2 << (flags & 7))
+            global_palette = _gif_palette(data[pos:pos + table_size])
+            pos += table_size
+        transparent = False
+        while pos < len(data) and data[pos] != 0x3B:
+            if data[pos] == 0x21:
+                # Graphic control extensions say whether the next image has
+                # transparent pixels
+                if data[pos + 1] == 0xF9:
+                    transparent = bool(data[pos + 3] & 1)
+                pos = _skip_sub_blocks(data, pos + 2)
+            elif data[pos] == 0x2C:
+                x, y, w, h, image_flags = struct.unpack("<HHHHB", data[pos + 1:pos + 10])
+                pos += 10
+                palette = global_palette
+                if image_flags & 0x80:
+                    table_size = 3 * (2 << (image_flags & 7))
+                    palette = _gif_palette(data[pos:pos + table_size])
+                    pos += table_size
+                code_size = data[pos]
+                end = _skip_sub_blocks(data, pos + 1)
+                whole = (x, y, w) == (0, 0, width) and h <= height and not transparent
+                images.append(GifImage(pos + 1, end - pos - 1, (w, h), code_size,
+                                       bool(image_flags & 0x40), palette, whole))
+                pos = end
+                transparent = False
+            else:
+                raise ValueError(f"Corrupt GIF block at byte {pos} of {src}")
+    return (width, height), images
+
+def decode_gif_image(src, image):
+    # Decompress one image found by scan_gif on its own, as a frame in the
+    # (indices, palette) form of iter_gif_frames
+    with file_bytes(src) as gif:
+        data = gif[image.offset:image.offset + image.length]
+    frame = Image.new("P", image.size)
+    decoder = Image._getdecoder("P", "gif", (image.code_size, image.interlace, -1))
+    decoder.setimage(frame.im, (0, 0) + image.size)
+    status, error = decoder.decode(data)
+    if error < 0 or status >= 0:
+        raise OSError(f"Truncated or corrupt GIF image at byte {image.offset} of {src}")
+    return np.asarray(frame).reshape(-1), image.palette
+
 def make_gif(parent_folder, fname):
     items = os.listdir(parent_folder)
     png_filenames = [elem for elem in items if elem.endswith(".png")]
@@ -18,69 +339,481 @@ def make_gif(parent_folder, fname):
         key=lambda p: int(p.split("-")[1].split(".")[0])
     )
 
-    with imageio.get_writer(f"{fname}.gif", mode="I", duration=0.1) as writer:
-        for filename in sorted_png:
-            image = imageio.imread(os.path.join(parent_folder, filename))
-            writer.append_data(image)
-    return f"{fname}.gif"
+    frames = (imageio.imread(os.path.join(parent_folder, filename)) for filename in sorted_png)
+    return frames_2_gif(frames, f"{fname}.gif")
+
+def pixels_2_frame(pixels, reso=None):
+    # Unfilled pixels stay black, as with Image.new("RGB", reso). Without
+    # `reso` the frame is sized to the pixels, as with res="auto".
+    reso = reso or auto_res(len(pixels))
+    frame = np.zeros((reso[1] * reso[0], 3), dtype=np.uint8)
+    frame[:len(pixels)] = pixels
+    return frame.reshape(reso[1], reso[0], 3)
 
-def pixels_2_png(pixels, fname, reso=four_k):
-    img = Image.new("RGB", reso)
-    img.putdata(pixels)
+def density_palette(density):
+    # Colour of each pixel value: evenly spaced greys from black to white
+    levels = np.arange(2 ** density) * 255 // (2 ** density - 1)
+    return np.repeat(levels.astype(np.uint8)[:, None], 3, axis=1)
+
+def pixels_2_png(pixels, fname, reso=None):
+    img = Image.fromarray(pixels_2_frame(pixels, reso), "RGB")
     img.save(fname)
-    print(f"pixels_2_png: Saved {len(pixels)} pixels to {fname}")
 
 def png_2_pixels(fname):
     with Image.open(fname) as im:
-        pixel_list = list(im.getdata())
-    print(f"png_2_pixels: Read {len(pixel_list)} pixels from {fname}")
+        pixel_list = np.asarray(im.convert("RGB")).reshape(-1, 3)
     return pixel_list
 
 def bits_2_file(bits, fname):
+    stream_bits_2_file([bits], fname)
+
+def stream_bits_2_file(chunks, fname):
+    # Write a stream of Bits chunks to `fname` as they arrive
     with open(fname, "wb") as f:
-        for idx in range(0, len(bits), 8):
-            byte = bits[idx:idx + 8]
-            f.write(int("".join(byte), 2).to_bytes(1, "big"))
+        for piece in align_bits(chunks):
+            whole, rem = divmod(piece.nbits, 8)
+            f.write(piece.data[:whole].tobytes())
+            if rem:
+                # A trailing partial byte is written right-aligned, as int(bits, 2) did
+                f.write(int(piece.data[whole] >> (8 - rem)).to_bytes(1, "big"))
 
 def file_2_bits(fname):
-    bits = []
-    with open(fname, "rb") as f:
-        byte = f.read(1)
-        while byte:
-            bits.extend(bin(ord(byte))[2:].zfill(8))
-            byte = f.read(1)
-    return bits
+    data = np.fromfile(fname, dtype=np.uint8)
+    return Bits(data, data.size * 8)
 
-def bits_2_pixels(bits):
-    pixels = [(0, 0, 0) if b == "0" else (255, 255, 255) for b in bits]
-    print(f"bits_2_pixels: Converted {len(bits)} bits to {len(pixels)} pixels")
-    return pixels
+def bits_2_values(bits, density=1):
+    # Cut a bit stream into `density` bit pixel values, zero padding the
+    # last one. Values are uint8, or RGB byte triples for density 24.
+    count = -(-bits.nbits // density)
+    if density == 1:
+        return np.unpackbits(bits.data, count=count)
+    if density in (8, 24):
+        values = np.zeros(count * density // 8, dtype=np.uint8)
+        values[:bits.data.size] = bits.data[:values.size]
+        return values.reshape(-1, 3) if density == 24 else values
+    per_byte = 8 // density
+    values = np.empty((bits.data.size, per_byte), dtype=np.uint8)
+    for j in range(per_byte):
+        values[:, j] = (bits.data >> (8 - density * (j + 1))) & (2 ** density - 1)
+    return values.reshape(-1)[:count]
 
-def pixels_2_bits(pixels):
-    bits = ["0" if p == (0, 0, 0) else "1" for p in pixels]
-    print(f"pixels_2_bits: Converted {len(pixels)} pixels to {len(bits)} bits")
-    return bits
+def values_2_bits(values, density=1):
+    values = np.asarray(values, dtype=np.uint8)
+    if density == 1:
+        return Bits(np.packbits(values), values.size)
+    if density in (8, 24):
+        return Bits(values.reshape(-1).copy(), values.size * 8)
+    per_byte = 8 // density
+    padded = np.zeros(-(-values.size // per_byte) * per_byte, dtype=np.uint8)
+    padded[:values.size] = values
+    padded = padded.reshape(-1, per_byte)
+    data = np.zeros(len(padded), dtype=np.uint8)
+    for j in range(per_byte):
+        data |= padded[:, j] << (8 - density * (j + 1))
+    return Bits(data, values.size * density)
+
+def values_2_pixels(values, density=1):
+    if density == 24:
+        return values
+    return density_palette(density)[values]
+
+def pixels_2_values(pixels, density=1):
+    pixels = np.asarray(pixels).reshape(-1, 3)
+    if density == 24:
+        return pixels
+    if density == 1:
+        # Anything that isn't pure black reads as a 1
+        return pixels.any(axis=1).astype(np.uint8)
+    # Map each grey level to the nearest palette entry
+    top = 2 ** density - 1
+    levels = (np.arange(256) * top + 127) // 255
+    return levels.astype(np.uint8)[pixels[:, 0]]
+
+def bits_2_pixels(bits, density=1):
+    return values_2_pixels(bits_2_values(bits, density), density)
 
-def add_header(bits, fname):
+def pixels_2_bits(pixels, density=1):
+    return values_2_bits(pixels_2_values(pixels, density), density)
+
+def header_bits(fname, payload_nbits, digest=None):
+    # The header only depends on the name, payload size and digest, so
+    # streaming encoders can write it before reading the payload. A payload
+    # digest, when there is one, goes right after the payload length.
     fname_bitstr = bin(int(binascii.hexlify(fname.encode()), 16))[2:]
     fname_bitstr_length_bitstr = bin(len(fname_bitstr))[2:].zfill(16)
-    payload_length_header = bin(len(bits))[2:].zfill(64)
-    header_list = list(fname_bitstr_length_bitstr + fname_bitstr + payload_length_header)
-    return header_list + bits
+    payload_length_header = bin(payload_nbits)[2:].zfill(64)
+    bits = str_2_bits(fname_bitstr_length_bitstr + fname_bitstr + payload_length_header)
+    if digest is not None:
+        bits = join_bits([bits, Bits(np.frombuffer(digest, dtype=np.uint8), len(digest) * 8)])
+    return bits
 
+def add_header(bits, fname, digest=None):
+    return join_bits([header_bits(fname, bits.nbits, digest), bits])
 
-import re
+# Integrity data. The key check value is a salted tag of the stretched
+# key, kept in the preamble so a wrong key is rejected before anything is
+# decrypted; testing a guessed key against it costs a full scrypt
+# derivation, as decrypting does. The payload digest is a BLAKE2b hash of
+# the original file, kept encrypted in the header and checked as the
+# recovered file is written.
+KEY_CHECK_SALT = 8
+KEY_CHECK_SIZE = 8
+DIGEST_NAME = "blake2b"
+DIGEST_SIZE = 32
 
-def decode_header(bits):
+def key_check_value(key, salt):
+    # The salt is shorter than a stream nonce, so the stretched key is never
+    # one a file is encrypted with
+    return hashlib.blake2b(derive_stream_key(key, salt), digest_size=KEY_CHECK_SIZE, person=b"hybcrypt-kcv").digest()
+
+def make_key_check(key):
+    salt = os.urandom(KEY_CHECK_SALT)
+    return salt + key_check_value(key, salt)
+
+def check_key(fields, key):
+    # Raise ValueError if the preamble has a key check value that `key`
+    # doesn't match. Legacy GIFs have none and can't be checked.
+    value = fields.get(b"k")
+    if value is None:
+        return
+    salt, expected = value[:KEY_CHECK_SALT], value[KEY_CHECK_SALT:]
+    if not hmac.compare_digest(key_check_value(key, salt), expected):
+        raise ValueError("Wrong key: it does not match the key check value in the GIF")
+
+def payload_hash():
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+def file_digest(src, chunk_size=1 << 20):
+    digest = payload_hash()
+    with open(src, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+def preamble_digest_size(fields):
+    # Size in bytes of the payload digest in the header, 0 if there is none
+    name = fields.get(b"h")
+    if name is None:
+        return 0
+    if name.decode("ascii", "replace") != DIGEST_NAME:
+        raise ValueError(f"Unsupported payload digest {name!r}")
+    return DIGEST_SIZE
+
+def iter_verified(chunks, digest):
+    # Pass through a whole-byte stream of Bits chunks, raising ValueError at
+    # the end if it doesn't hash to `digest`
+    actual = payload_hash()
+    for piece in align_bits(chunks):
+        actual.update(piece.data[:piece.nbits // 8].tobytes())
+        yield piece
+    if not hmac.compare_digest(actual.digest(), digest):
+        raise ValueError("Payload digest mismatch: the GIF is damaged or was altered")
+
+# Versioned format record. GIFs from before it was introduced have none and
+# are read as the legacy layout: one bit per pixel, frames of any size.
+PREAMBLE_MAGIC = b"HYBCRYPT"
+FORMAT_VERSION = 2
+
+def make_preamble(density=1, compression=None, key_check=None, digest=False, index=None, cipher=None, nonce=None):
+    # The preamble is written unencrypted at one bit per pixel (black or
+    # white) at the start of the first frame, ahead of the header, so the
+    # decoder can read it before it knows the density. Each field is a
+    # one-byte tag, a two-byte length and the value. Returns None when every
+    # option has its legacy value, so default output stays in the legacy
+    # layout. `key_check` is a value from make_key_check; `digest` says the
+    # header carries a payload digest; `index` is a FrameIndex; `cipher`
+    # names one of CIPHERS (None for the legacy one) and `nonce` is its
+    # per-file nonce.
+    fields = {}
+    if density != 1:
+        fields[b"d"] = bytes([density])
+    if compression is not None:
+        fields[b"c"] = compression.encode()
+    if key_check is not None:
+        fields[b"k"] = key_check
+    if digest:
+        fields[b"h"] = DIGEST_NAME.encode()
+    if index is not None:
+        fields[b"i"] = struct.pack(">QQQQ", *index)
+    if cipher not in (None, LEGACY_CIPHER):
+        fields[b"e"] = cipher.encode()
+    if nonce is not None:
+        fields[b"n"] = nonce
+    if not fields:
+        return None
+    body = b"".join(tag + struct.pack(">H", len(value)) + value for tag, value in fields.items())
+    data = PREAMBLE_MAGIC + struct.pack(">BH", FORMAT_VERSION, len(body)) + body
+    return Bits(np.frombuffer(data, dtype=np.uint8).copy(), len(data) * 8)
+
+# Sizes of the fixed-size preamble fields, checked as the preamble is read
+PREAMBLE_FIELD_SIZES = {b"d": 1, b"k": KEY_CHECK_SALT + KEY_CHECK_SIZE, b"i": 32}
+
+def read_preamble(bits):
+    # Returns (fields, preamble_nbits), or (None, 0) for a legacy stream.
+    # Raises ValueError for a field that runs past the end of the preamble
+    # or has the wrong size.
+    fixed = len(PREAMBLE_MAGIC) * 8 + 24
+    if bits.nbits < fixed or slice_bits(bits, 0, 64).data.tobytes() != PREAMBLE_MAGIC:
+        return None, 0
+    version, length = struct.unpack(">BH", slice_bits(bits, 64, 24).data.tobytes())
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Unsupported format version {version}")
+    if bits.nbits < fixed + length * 8:
+        raise ValueError("Format preamble does not fit in the first frame")
+    body = slice_bits(bits, fixed, length * 8).data.tobytes()
+    fields = {}
+    pos = 0
+    while pos < len(body):
+        if pos + 3 > len(body):
+            raise ValueError(f"Corrupt preamble: truncated field at byte {pos}")
+        tag = body[pos:pos + 1]
+        size, = struct.unpack(">H", body[pos + 1:pos + 3])
+        if pos + 3 + size > len(body):
+            raise ValueError(f"Corrupt preamble: field {tag!r} runs past the end")
+        if tag in PREAMBLE_FIELD_SIZES and size != PREAMBLE_FIELD_SIZES[tag]:
+            raise ValueError(f"Corrupt preamble: field {tag!r} is {size} bytes, not {PREAMBLE_FIELD_SIZES[tag]}")
+        fields[tag] = body[pos + 3:pos + 3 + size]
+        pos += 3 + size
+    return fields, fixed + length * 8
+
+def preamble_density(fields):
+    density = fields.get(b"d", b"\x01")[0]
+    if density not in DENSITIES:
+        raise ValueError(f"Unsupported density {density}")
+    return density
+
+# Where the payload sits in the frames, so decode_range can go straight to
+# the frames holding a slice: the stream bits each frame holds (the first
+# frame holds the preamble's pixels fewer), the number of frames, and the
+# payload's bit offset and length in the stream
+FrameIndex = namedtuple("FrameIndex", ["frame_nbits", "frames", "payload_offset", "payload_nbits"])
+
+def indexed_preamble(res, density, stream_nbits, header_nbits, payload_nbits, **options):
+    # make_preamble(density, **options) with a FrameIndex for a stream of
+    # `stream_nbits` bits, or None if there is no preamble to hold it
+    if make_preamble(density, **options) is None:
+        return None
+    # The index has a fixed size, so a blank one gives the frame count
+    blank = make_preamble(density, index=FrameIndex(0, 0, 0, 0), **options)
+    index = FrameIndex(res[0] * res[1] * density, frame_count(stream_nbits, res, density, blank),
+                       header_nbits, payload_nbits)
+    return make_preamble(density, index=index, **options)
+
+def auto_res(pixels):
+    # Frame size for res="auto" for a stream of `pixels` pixels, preamble
+    # included
+    width = min(AUTO_MAX_WIDTH, max(1, math.isqrt(pixels - 1) + 1))
+    height = min(GIF_MAX_SIDE, AUTO_MAX_PIXELS // width, max(1, -(-pixels // width)))
+    return width, height
+
+def frame_res(res, density, stream_nbits, **options):
+    # `res`, or for res="auto" the auto_res size for a stream of
+    # `stream_nbits` bits and the preamble make_preamble(density, **options)
+    # puts in front of it
+    if res != AUTO_RES:
+        return res
+    pixels = -(-stream_nbits // density)
+    if make_preamble(density, **options) is not None:
+        # The index has a fixed size, so a blank one gives the preamble's
+        pixels += make_preamble(density, index=FrameIndex(0, 0, 0, 0), **options).nbits
+    return auto_res(pixels)
+
+def check_frame_size(res, density=1, container="gif", compression=None, integrity=True, cipher=None):
+    # Raise ValueError if encode can't write `res` sized frames of
+    # `container` with these options: a side the container can't store, or
+    # a first frame too small for the preamble. For callers that have to
+    # reject options before encoding starts. `cipher` defaults to
+    # DEFAULT_CIPHER.
+    if res == AUTO_RES:
+        return
+    _check_res(res, check_container(container, density).max_side)
+    cipher = check_cipher(cipher or DEFAULT_CIPHER)
+    compression = check_compression(compression)
+    # Every field but the compression name has a fixed size; "auto" may
+    # pick any algorithm
+    names = COMPRESSIONS if compression == "auto" else [compression]
+    for name in names:
+        key_check = bytes(KEY_CHECK_SALT + 8) if integrity else None
+        nonce = bytes(cipher.nonce_size) if cipher.nonce_size else None
+        options = dict(compression=name, key_check=key_check, digest=integrity, cipher=cipher.name, nonce=nonce)
+        # The legacy layout has no preamble, and so no index either
+        if make_preamble(density, **options) is None:
+            continue
+        preamble = make_preamble(density, index=FrameIndex(0, 0, 0, 0), **options)
+        if preamble.nbits >= res[0] * res[1]:
+            raise ValueError(f"Frames of {res[0]}x{res[1]} are too small to hold the format preamble "
+                             f"({preamble.nbits} pixels)")
+
+def preamble_index(fields):
+    value = fields.get(b"i")
+    return None if value is None else FrameIndex(*struct.unpack(">QQQQ", value))
+
+def preamble_stream_key(fields, key):
+    # The StreamKey that decrypts a stream with preamble `fields`, from the
+    # binary key
+    name = fields.get(b"e", LEGACY_CIPHER.encode()).decode("ascii", "replace")
+    if name not in CIPHERS:
+        raise ValueError(f"Unsupported cipher {name!r}")
+    cipher = CIPHERS[name]
+    nonce = fields.get(b"n")
+    if cipher.nonce_size and (nonce is None or len(nonce) != cipher.nonce_size):
+        raise ValueError(f"The preamble has no valid nonce for cipher {name!r}")
+    return StreamKey(name, cipher.engine_key(key, nonce))
+
+def preamble_compression(fields):
+    name = fields.get(b"c")
+    if name is None:
+        return None
+    name = name.decode("ascii", "replace")
+    if name not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression {name!r}")
+    return name
+
+# Optional compression of the payload ahead of the cipher. The name goes in
+# the preamble so decode undoes it. zstd needs the zstandard package.
+COMPRESSIONS = ("zlib", "lzma", "zstd")
+
+# "auto" compresses the first AUTO_SAMPLE bytes and only goes ahead if they
+# shrink to under AUTO_RATIO of their size; random or already compressed
+# data is stored as is
+AUTO_SAMPLE = 1 << 20
+AUTO_RATIO = 0.9
+
+def _compressor(name):
+    if name == "zlib":
+        return zlib.compressobj(6)
+    if name == "lzma":
+        return lzma.LZMACompressor(preset=6)
+    return zstandard.ZstdCompressor(level=3).compressobj()
+
+def _decompressor(name):
+    if name == "zlib":
+        return zlib.decompressobj()
+    return lzma.LZMADecompressor()
+
+def compress_bytes(data, name):
+    compressor = _compressor(name)
+    return compressor.compress(data) + compressor.flush()
+
+def check_compression(compression):
+    # Validate an encode `compression` option; returns None for no
+    # compression, or the algorithm name (or "auto")
+    if compression in (None, "none"):
+        return None
+    if compression == "auto":
+        return compression
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Compression is one of none, auto, {', '.join(COMPRESSIONS)}; not {compression!r}")
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package")
+    return compression
+
+def auto_compression(sample):
+    # The algorithm "auto" uses for data starting with `sample`, or None if
+    # it wouldn't pay off
+    name = "zstd" if zstandard is not None else "zlib"
+    sample = bytes(sample[:AUTO_SAMPLE])
+    if not sample or len(compress_bytes(sample, name)) >= AUTO_RATIO * len(sample):
+        return None
+    return name
+
+def compress_file(src, name, target, chunk_size=1 << 20):
+    # Compress `src` into the open binary file `target` a chunk at a time;
+    # returns the compressed size
+    compressor = _compressor(name)
+    with open(src, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            target.write(compressor.compress(chunk))
+    target.write(compressor.flush())
+    return target.tell()
+
+# Decompressed output comes in pieces of at most DECOMPRESS_CHUNK bytes,
+# so a small payload that expands enormously is never held in memory whole
+DECOMPRESS_CHUNK = 1 << 20
+
+def _inflate(decompressor, data):
+    # Everything a zlib or lzma decompressor makes of `data`, a bounded
+    # piece at a time: input zlib couldn't use yet comes back in
+    # unconsumed_tail, lzma keeps it and clears needs_input
+    while True:
+        out = decompressor.decompress(data, DECOMPRESS_CHUNK)
+        if out:
+            yield out
+        if isinstance(decompressor, lzma.LZMADecompressor):
+            data = b""
+            if decompressor.eof or decompressor.needs_input:
+                return
+        else:
+            data = decompressor.unconsumed_tail
+            if not data and (decompressor.eof or len(out) < DECOMPRESS_CHUNK):
+                return
+
+class _IterReader:
+    # A file-like read() over an iterator of bytes, for zstandard's
+    # read_to_iter
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.pending = memoryview(b"")
+
+    def read(self, size=-1):
+        while not self.pending:
+            piece = next(self.pieces, None)
+            if piece is None:
+                return b""
+            self.pending = memoryview(piece)
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data.tobytes()
+
+def iter_decompressed(chunks, name):
+    # Decompress a stream of whole-byte Bits chunks
+    pieces = (piece.data[:piece.nbits // 8].tobytes() for piece in align_bits(chunks))
+    if name == "zstd":
+        decompressor = None
+        output = zstandard.ZstdDecompressor().read_to_iter(_IterReader(pieces), write_size=DECOMPRESS_CHUNK)
+    else:
+        decompressor = _decompressor(name)
+        output = itertools.chain.from_iterable(_inflate(decompressor, data) for data in pieces)
+    for data in output:
+        yield Bits(np.frombuffer(data, dtype=np.uint8), len(data) * 8)
+    if decompressor is not None and not decompressor.eof:
+        raise ValueError("Compressed payload is truncated")
+
+def _pad_even(bits):
+    # The Polybius stage drops an unpaired final bit, so encode pads it
+    # instead and the last payload bit survives. Decoders, old ones too,
+    # stop at the payload length in the header and never read the pad.
+    if bits.nbits % 2:
+        return join_bits([bits, Bits(np.zeros(1, dtype=np.uint8), 1)])
+    return bits
+
+def _check_gif_density(density):
+    if density not in GIF_DENSITIES:
+        raise ValueError(f"GIF frames hold 1, 2, 4 or 8 bits per pixel, not {density}")
+
+def _check_res(res, max_side=GIF_MAX_SIDE):
+    if not all(1 <= side <= max_side for side in res):
+        raise ValueError(f"Frames are 1 to {max_side} pixels a side, not {res[0]}x{res[1]}")
+
+
+def read_header(bits, digest_size=0):
+    # Parse the header at the start of `bits`, which ends with a
+    # `digest_size` byte payload digest if there is one.
+    # Returns (fname, payload_length, header_nbits).
     def decode_binary_string(s):
         try:
             return ''.join(chr(int(s[i * 8:i * 8 + 8], 2)) for i in range(len(s) // 8))
         except ValueError:
             return None
 
-    fname_length = int(''.join(bits[:16]), 2)
-    fname_bits = ''.join(bits[16:16 + fname_length])
-    payload_length = int(''.join(bits[16 + fname_length:16 + fname_length + 64]), 2)
+    fname_length = int(bits_2_str(slice_bits(bits, 0, 16)), 2)
+    fname_bits = bits_2_str(slice_bits(bits, 16, fname_length))
+    payload_length = int(bits_2_str(slice_bits(bits, 16 + fname_length, 64)), 2)
+
+    # The name was written without its leading zero bits; restore them so
+    # the characters line up with byte boundaries again
+    fname_bits = fname_bits.zfill(-(-fname_length // 8) * 8)
 
     # Decode the file name and handle decoding errors
     fname = decode_binary_string(fname_bits)
@@ -90,134 +823,1111 @@ def decode_header(bits):
     # Sanitize the filename by keeping only alphanumeric characters, underscores, and dots
     fname = re.sub(r'[^A-Za-z0-9_.]', '_', fname)
 
-    return fname, bits[16 + fname_length + 64:16 + fname_length + 64 + payload_length]
-	
-def decode(src,binary_key):
-    def iter_frames(im):
-        try:
-            i = 0
-            while True:
-                im.seek(i)
-                yield im.convert("RGB")
-                i += 1
-        except EOFError:
-            pass
+    return fname, payload_length, 16 + fname_length + 64 + digest_size * 8
+
+def decode_header(bits):
+    fname, payload_length, header_nbits = read_header(bits)
+    return fname, slice_bits(bits, header_nbits, payload_length)
+
+def split_header(chunks, digest_size=0, max_nbits=None):
+    # Streaming decode_header: reads just enough chunks to parse the header.
+    # Returns (fname, payload_chunks, digest), digest being None unless
+    # `digest_size` is set. A header or payload that couldn't fit in
+    # `max_nbits`, the capacity of the container, is rejected before
+    # anything else is read.
+    chunks = iter(chunks)
+    head = []
+
+    def pull(nbits):
+        while sum(c.nbits for c in head) < nbits:
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            head.append(chunk)
+        return join_bits(head)
+
+    fname_length = int(bits_2_str(slice_bits(pull(16), 0, 16)), 2)
+    header_nbits = 16 + fname_length + 64 + digest_size * 8
+    if max_nbits is not None and header_nbits > max_nbits:
+        raise ValueError("Header is longer than the GIF can hold: wrong key or not an encoded GIF")
+    bits = pull(header_nbits)
+    fname, payload_length, header_nbits = read_header(bits, digest_size)
+    if max_nbits is not None and header_nbits + payload_length > max_nbits:
+        raise ValueError(f"Payload length {payload_length} is more than the GIF can hold: "
+                         "wrong key or not an encoded GIF")
+    digest = None
+    if digest_size:
+        digest = slice_bits(bits, header_nbits - digest_size * 8, digest_size * 8).data.tobytes()
+
+    def payload():
+        yield slice_bits(bits, header_nbits, bits.nbits - header_nbits)
+        yield from chunks
+
+    return fname, take_bits(payload(), payload_length), digest
+
+# Palette of an "L" frame: index i is grey level i
+_GREY_PALETTE = np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
 
-    pixels = []
+def iter_gif_frames(src):
+    # Every frame of the GIF, one at a time, as (indices, palette): the raw
+    # palette indices and the (256, 3) RGB palette they refer to. Frames
+    # Pillow can only offer as RGB come back as (pixels, None). When every
+    # image can be decoded on its own, as in the GIFs encode writes, each is
+    # decompressed directly and holds only its own pixels, so a trimmed
+    # last frame comes back trimmed.
+    _, images = scan_gif(src)
+    if images and all(image.whole and image.palette is not None for image in images):
+        for image in images:
+            yield decode_gif_image(src, image)
+        return
     with Image.open(src) as im:
-        for frame in iter_frames(im):
-            pixels.extend(list(frame.getdata()))
-    
-    bits = pixels_2_bits(pixels)
-    bits = binary_vigenere_decrypt(bits,binary_key)
-    bits=polybius_cipher_binary_reverse(bits)
-    fname, bits = decode_header(bits)
+        i = 0
+        while True:
+            try:
+                with _palette_gif_loading():
+                    frame = _pillow_gif_frame(im, i)
+            except EOFError:
+                return
+            yield frame
+            i += 1
+
+# Pillow reads its GIF loading strategy from a module global as each frame
+# is seeked and loaded. The fallback reader sets it only while it loads a
+# frame, under a lock, so other users of Pillow in the process keep theirs.
+_gif_loading_lock = threading.Lock()
+
+@contextmanager
+def _palette_gif_loading():
+    # Keep later GIF frames as palette images when they share the first
+    # frame's palette, instead of Pillow's default of converting them to
+    # RGB, so decode can read their indices directly
+    with _gif_loading_lock:
+        saved = GifImagePlugin.LOADING_STRATEGY
+        GifImagePlugin.LOADING_STRATEGY = GifImagePlugin.LoadingStrategy.RGB_AFTER_DIFFERENT_PALETTE_ONLY
+        try:
+            yield
+        finally:
+            GifImagePlugin.LOADING_STRATEGY = saved
+
+def _pillow_gif_frame(im, i):
+    # Frame `i` of an open Pillow GIF, as iter_gif_frames gives it
+    im.seek(i)
+    if im.mode == "P":
+        palette = np.zeros((256, 3), dtype=np.uint8)
+        colours = np.array(im.getpalette("RGB"), dtype=np.uint8).reshape(-1, 3)[:256]
+        palette[:len(colours)] = colours
+        return np.asarray(im).reshape(-1), palette
+    if im.mode == "L":
+        return np.asarray(im).reshape(-1), _GREY_PALETTE
+    return np.asarray(im.convert("RGB")).reshape(-1, 3), None
+
+def frame_2_bits(frame, density=1, skip=0):
+    # Bits of a frame from iter_gif_frames, starting at pixel `skip`. The
+    # palette is mapped to pixel values once, with the same rules as
+    # pixels_2_values (at density 1 only pure black is a 0), and then
+    # indexed by the whole frame.
+    pixels, palette = frame
+    if palette is None:
+        return pixels_2_bits(pixels[skip:], density)
+    values = pixels_2_values(palette, density)[pixels[skip:]]
+    return values_2_bits(values, density)
+
+def split_preamble(frames):
+    # Returns (preamble fields, stream chunks) for frames from
+    # iter_gif_frames. Legacy GIFs have no preamble and give empty fields.
+    frames = iter(frames)
+    first = next(frames)
+    lead = frame_2_bits(first)
+    fields, preamble_nbits = read_preamble(lead)
+    if fields is None:
+        return {}, itertools.chain([lead], (frame_2_bits(frame) for frame in frames))
+    density = preamble_density(fields)
+    first_bits = frame_2_bits(first, density, skip=preamble_nbits)
+    return fields, itertools.chain([first_bits], (frame_2_bits(frame, density) for frame in frames))
+
+def iter_decrypted_chunks(chunks, key):
+    # binary_hybrid_decrypt over a stream of Bits chunks, carrying the
+    # keystream offset from one chunk to the next. `key` is a StreamKey or
+    # a binary key for the legacy cipher.
+    offset = 0
+    for piece in align_bits(chunks):
+        # Only the final piece can have an odd bit, which has no Polybius pair
+        nbits = piece.nbits - piece.nbits % 2
+        data = stream_decrypt(piece.data[:(nbits + 7) // 8], key, offset)
+        offset += piece.nbits // 8
+        yield Bits(_mask_tail(data, nbits), nbits)
+
+def decrypt_bits_at(bits, key, offset):
+    # binary_hybrid_decrypt for a piece of the stream starting `offset` bits
+    # in. The offset must be even so no Polybius pair crosses the start.
+    lead = offset % 8
+    if lead:
+        bits = join_bits([Bits(np.zeros(1, dtype=np.uint8), lead), bits])
+    nbits = bits.nbits - bits.nbits % 2
+    data = stream_decrypt(bits.data[:(nbits + 7) // 8], key, offset // 8)
+    return slice_bits(Bits(_mask_tail(data, nbits), nbits), lead, nbits - lead)
+
+def _decode_frame_job(job):
+    container, src, image, density, key, offset = job
+    return decrypt_bits_at(frame_2_bits(CONTAINERS[container].read(src, image), density), key, offset)
 
-    # Ensure the recovered file name has its original extension (or defaults to .bin)
-    if '.' in fname:
-        recovered_fname = f"recovered_files/{fname.split('.')[0]}-recovered.{fname.split('.')[-1]}"
+def decrypt_parallel(src, key, workers=None):
+    # Pipelined decode: the container's scan finds the frames in order, a
+    # process pool decompresses, converts and decrypts them, each job
+    # starting the keystream at its frame's stream offset, and the decrypted
+    # chunks come back in order. `key` is the binary key. Returns (preamble
+    # fields, decrypted chunks), or None if the frames can't be decoded
+    # independently.
+    container = detect_container(src)
+    _, images = container.scan(src)
+    if not images or not all(image.whole for image in images):
+        return None
+    first = container.read(src, images[0])
+    fields, preamble_nbits = read_preamble(frame_2_bits(first))
+    fields = fields or {}
+    density = preamble_density(fields)
+    # Checked before any work is handed out
+    check_key(fields, key)
+    key = preamble_stream_key(fields, key)
+    sizes = [image.size[0] * image.size[1] * density for image in images]
+    sizes[0] -= preamble_nbits * density
+    # Polybius pairs must not straddle frames
+    if any(size % 2 for size in sizes[:-1]):
+        return None
+    first_bits = decrypt_bits_at(frame_2_bits(first, density, preamble_nbits), key, 0)
+    offsets = itertools.accumulate(sizes)
+    jobs = ((container.name, src, image, density, key, offset) for image, offset in zip(images[1:], offsets))
+    return fields, itertools.chain([first_bits], ordered_pool_map(_decode_frame_job, jobs, workers))
+
+def open_payload(src, binary_key, workers=1, report=None):
+    # The decode pipeline up to the recovered bytes: returns (fname,
+    # payload chunks). The key and header are checked here; the digest
+    # once the last chunk is read. `report` is called for every frame.
+    container = detect_container(src)
+    (width, height), images = container.scan(src)
+    parallel = None if workers == 1 else decrypt_parallel(src, binary_key, workers)
+    if parallel is not None:
+        fields, chunks = parallel
     else:
-        recovered_fname = f"recovered_files/{fname}-recovered.bin"  # Default to .bin if no extension
+        fields, chunks = split_preamble(container.iter_frames(src))
+        check_key(fields, binary_key)
+        chunks = iter_decrypted_chunks(chunks, preamble_stream_key(fields, binary_key))
+    if report is not None:
+        chunks = _reported(chunks, report, lambda chunk: chunk.nbits // 8)
+    # Every frame is read back at the full logical screen size, even when
+    # another program stored only the part that changed; a PNG is a single
+    # image read in bands
+    frames = 1 if container.name == "png" else len(images)
+    capacity = frames * width * height * preamble_density(fields)
+    fname, payload, digest = split_header(chunks, preamble_digest_size(fields), capacity)
+    compression = preamble_compression(fields)
+    if compression is not None:
+        payload = iter_decompressed(payload, compression)
+    if digest is not None:
+        payload = iter_verified(payload, digest)
+    return fname, payload
+
+def decode_range(src, binary_key, offset, length):
+    # `length` bytes of the original file starting at byte `offset` (fewer
+    # at the end of the file). Files with a frame index whose frames can be
+    # read on their own only have the frames holding the slice decoded,
+    # with the keystream started at the slice; others (and single tall
+    # PNGs) are decoded from the start up to the end of the slice. The
+    # payload digest covers the whole file and isn't checked.
+    if offset < 0 or length < 0:
+        raise ValueError("offset and length must not be negative")
+    container = detect_container(src)
+    _, images = container.scan(src)
+    first = container.read(src, images[0]) if images and all(image.whole for image in images) else None
+    fields, preamble_nbits = read_preamble(frame_2_bits(first)) if first is not None else (None, 0)
+    index = preamble_index(fields) if fields is not None else None
+    if index is None or preamble_compression(fields) is not None or len(images) != index.frames:
+        fname, payload = open_payload(src, binary_key)
+        return _read_slice(payload, offset, length)
+    check_key(fields, binary_key)
+    density = preamble_density(fields)
+
+    end = min(offset + length, index.payload_nbits // 8)
+    if end <= offset:
+        return b""
+    # Stream bit range, widened to whole Polybius pairs
+    start_bit = index.payload_offset + offset * 8
+    end_bit = index.payload_offset + end * 8
+    lo = start_bit - start_bit % 2
+    hi = end_bit + (end_bit - lo) % 2
+
+    # Stream offset of frame i is first_nbits + (i - 1) * frame_nbits
+    first_nbits = index.frame_nbits - preamble_nbits * density
+    def frame_of(bit):
+        return 0 if bit < first_nbits else 1 + (bit - first_nbits) // index.frame_nbits
+    def frame_start(i):
+        return 0 if i == 0 else first_nbits + (i - 1) * index.frame_nbits
 
-    # Ensure the folder exists before saving
-    os.makedirs("recovered_files", exist_ok=True)
+    pieces = []
+    for i in range(frame_of(lo), frame_of(hi - 1) + 1):
+        if i == 0:
+            pieces.append(frame_2_bits(first, density, preamble_nbits))
+        else:
+            pieces.append(frame_2_bits(container.read(src, images[i]), density))
+    bits = slice_bits(join_bits(pieces), lo - frame_start(frame_of(lo)), hi - lo)
+    bits = decrypt_bits_at(bits, preamble_stream_key(fields, binary_key), lo)
+    return slice_bits(bits, start_bit - lo, (end - offset) * 8).data.tobytes()
 
-    # Save the recovered file in its original format
-    bits_2_file(bits, recovered_fname)
+def _read_slice(payload, offset, length):
+    # Bytes offset..offset+length of a stream of payload chunks
+    out = []
+    pos = 0
+    for piece in align_bits(payload):
+        data = piece.data[:piece.nbits // 8]
+        lo, hi = max(offset - pos, 0), min(offset + length - pos, data.size)
+        if lo < hi:
+            out.append(data[lo:hi].tobytes())
+        pos += data.size
+        if pos >= offset + length:
+            break
+    return b"".join(out)
+
+def decode(src,binary_key, workers=1, progress=None, out_dir="recovered_files", target=None):
+    # The container (GIF, APNG, PNG or WebP) is told from the file's first
+    # bytes. Frames are decrypted and written to the recovered file one at a time;
+    # the header comes from the first frame, and frames past the end of the
+    # payload are never read. With workers other than 1 (None for one per
+    # CPU) frames are decoded in a process pool when the GIF allows it.
+    # `progress` gets a Progress for every frame of the "decode" stage.
+    # A wrong key, when the GIF has a key check value, or a header that
+    # can't be right is a ValueError before the payload is read; a payload
+    # that fails its digest is a ValueError once read. A partial file is
+    # removed however the decode stops. The recovered file is written to `target` if given, or
+    # else to `out_dir` under a name made from the original one; its path
+    # is returned.
+    total_frames = None if progress is None else len(scan_frames(src)[1])
+    with progress_stage(progress, "decode", total_frames) as report:
+        fname, payload = open_payload(src, binary_key, workers, report if progress is not None else None)
+
+        if target is not None:
+            recovered_fname = target
+        # Ensure the recovered file name has its original extension (or defaults to .bin)
+        elif '.' in fname:
+            recovered_fname = os.path.join(out_dir, f"{fname.split('.')[0]}-recovered.{fname.split('.')[-1]}")
+        else:
+            recovered_fname = os.path.join(out_dir, f"{fname}-recovered.bin")  # Default to .bin if no extension
+
+        # Ensure the folder exists before saving
+        os.makedirs(os.path.dirname(recovered_fname) or ".", exist_ok=True)
+
+        # Save the recovered file in its original format
+        try:
+            stream_bits_2_file(payload, recovered_fname)
+        except BaseException:
+            if os.path.exists(recovered_fname):
+                os.remove(recovered_fname)
+            raise
+    return recovered_fname
 
 
 
 def test_bit_similarity(bits1, bits2):
-    if len(bits1) != len(bits2):
+    if bits1.nbits != bits2.nbits:
         print("Bit lengths are not the same!")
         return
-    for b1, b2 in zip(bits1, bits2):
-        if b1 != b2:
-            print("Bits are not the same!")
-            return
+    if not np.array_equal(bits1.data, bits2.data):
+        print("Bits are not the same!")
+        return
     print("Bits are identical")
 
+@contextmanager
+def job_workspace(root=None):
+    # A private directory for one encode or decode job, removed with
+    # everything in it when the job is done. Jobs that each use their own
+    # workspace and output paths can run side by side in one process.
+    if root is not None:
+        os.makedirs(root, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="hybridcrypt-", dir=root) as workspace:
+        yield workspace
+
 def clear_folder(relative_path):
     try:
         rmtree(relative_path)
     except FileNotFoundError:
-        print("WARNING: Could not locate /temp directory.")
+        # Nothing to clear yet
+        pass
     os.makedirs(relative_path, exist_ok=True)
+# Polybius square for binary data
+binary_polybius_square = {
+    "00": "11", "01": "10", "10": "01", "11": "00"
+}
+
+def _polybius_table(square):
+    # Byte-level substitution table: entry b holds b with each of its four
+    # 2-bit pairs replaced through the square
+    table = np.zeros(256, dtype=np.uint8)
+    for byte in range(256):
+        pairs = format(byte, "08b")
+        table[byte] = int("".join(square[pairs[i:i + 2]] for i in range(0, 8, 2)), 2)
+    return table
+
+_POLYBIUS_TABLE = _polybius_table(binary_polybius_square)
+_POLYBIUS_REVERSE_TABLE = _polybius_table({v: k for k, v in binary_polybius_square.items()})
+
+def polybius_substitute(data, table=_POLYBIUS_TABLE, out=None):
+    # mode="clip" lets take write in place; uint8 indices are always in range
+    return np.take(table, data, out=out, mode="clip")
+
 def polybius_cipher_binary(data):
-    # Define Polybius cipher square for binary data
-    polybius_square = {
-        "00": "11", "01": "10", "10": "01", "11": "00"
-    }
-    
-    # Initialize encrypted data string
-    encrypted_data = ""
-    
-    # Loop through the binary data in pairs of 2 bits
-    for i in range(0, len(data) - 1, 2):  # Process in steps of 2 (no padding)
-        pair = ''.join(data[i:i+2])  # Convert the list to a string
-        encrypted_data += polybius_square.get(pair, "")
-    
-    # Return the encrypted binary data
-    return encrypted_data
+    # Pairs are taken from the start of the stream, so a trailing odd bit
+    # has no pair and is dropped
+    nbits = data.nbits - data.nbits % 2
+    encrypted_data = polybius_substitute(data.data[:(nbits + 7) // 8])
+    return Bits(_mask_tail(encrypted_data, nbits), nbits)
 
 def polybius_cipher_binary_reverse(encrypted_data):
-    # Define the reverse Polybius cipher square for binary data
-    reverse_polybius_square = {
-        "00": "11", "01": "10", "10": "01", "11": "00"
-    }
-    
-    # Initialize the decrypted data string
-    decrypted_data = ""
-    
-    # Loop through the encrypted data in chunks of 2 bits
-    for i in range(0, len(encrypted_data), 2):
-        pair = ''.join(encrypted_data[i:i+2])  # Convert the list to a string
-        decrypted_data += reverse_polybius_square.get(pair, "")
-    
-    # Return the decrypted binary data
-    return decrypted_data
+    nbits = encrypted_data.nbits - encrypted_data.nbits % 2
+    decrypted_data = polybius_substitute(encrypted_data.data[:(nbits + 7) // 8], _POLYBIUS_REVERSE_TABLE)
+    return Bits(_mask_tail(decrypted_data, nbits), nbits)
+
+# Bytes per keystream block; a multiple of the key period, so each block
+# starts at the same key phase and can be broadcast over the payload.
+_XOR_BLOCK = 1 << 16
+
+@lru_cache(maxsize=32)
+def _key_block(key):
+    # One packed key period spans lcm(len(key), 8) bits, i.e. whole bytes
+    period = len(key) * 8 // math.gcd(len(key), 8)
+    pattern = str_2_bits(key * (period // len(key))).data
+    block = np.tile(pattern, -(-_XOR_BLOCK // pattern.size) + 1)
+    block.flags.writeable = False
+    return block, pattern.size
+
+def keystream_xor(data, key, offset=0, out=None):
+    # XOR packed bytes with the repeating binary key without building the
+    # repeated key. `offset` is the position of data[0] in the stream, in
+    # bytes, so a stream can be processed in chunks. Pass out=data to work
+    # in place.
+    block, period = _key_block(key)
+    phase = offset % period
+    size = block.size - period
+    block = block[phase:phase + size]
+    if out is None:
+        out = np.empty_like(data)
+    rows = data.size // size
+    main = rows * size
+    np.bitwise_xor(data[:main].reshape(rows, size), block, out=out[:main].reshape(rows, size))
+    np.bitwise_xor(data[main:], block[:data.size - main], out=out[main:])
+    return out
 
 def binary_vigenere_encrypt(data, key):
-    # Repeat the key to match the length of the data
-    repeated_key = (key * (len(data) // len(key) + 1))[:len(data)]
-    
-    # Perform XOR between data and repeated key
-    encrypted_data = ''.join(
-        str(int(bit) ^ int(repeated_key[i])) for i, bit in enumerate(data)
-    )   
-    return encrypted_data
+    encrypted_data = keystream_xor(data.data, key)
+    return Bits(_mask_tail(encrypted_data, data.nbits), data.nbits)
 
 def binary_vigenere_decrypt(encrypted_data, key):
-    # Repeat the key to match the length of the encrypted data
-    repeated_key = (key * (len(encrypted_data) // len(key) + 1))[:len(encrypted_data)]
-    
-    # Perform XOR between encrypted data and repeated key
-    decrypted_data = ''.join(
-        str(int(bit) ^ int(repeated_key[i])) for i, bit in enumerate(encrypted_data)
+    # XOR is its own inverse
+    return binary_vigenere_encrypt(encrypted_data, key)
+
+# Bytes per pass of the fused Polybius + XOR stage, small enough that the
+# substituted block is still in cache when it is XORed
+_FUSED_BLOCK = 1 << 18
+
+def polybius_xor_encrypt(data, key, offset=0, out=None):
+    # polybius_cipher_binary followed by binary_vigenere_encrypt on packed
+    # bytes, in one pass. `offset` is as for keystream_xor.
+    if out is None:
+        out = np.empty_like(data)
+    for start in range(0, data.size, _FUSED_BLOCK):
+        block = out[start:start + _FUSED_BLOCK]
+        polybius_substitute(data[start:start + _FUSED_BLOCK], out=block)
+        keystream_xor(block, key, offset + start, out=block)
+    return out
+
+def polybius_xor_decrypt(data, key, offset=0, out=None):
+    # Inverse of polybius_xor_encrypt
+    if out is None:
+        out = np.empty_like(data)
+    for start in range(0, data.size, _FUSED_BLOCK):
+        block = out[start:start + _FUSED_BLOCK]
+        keystream_xor(data[start:start + _FUSED_BLOCK], key, offset + start, out=block)
+        polybius_substitute(block, _POLYBIUS_REVERSE_TABLE, out=block)
+    return out
+
+# Keystream cipher: SHAKE-128 in counter mode. Block j of the keystream is
+# SHAKE-128(stream key || j) cut to _STREAM_BLOCK bytes, so any byte of it
+# can be reached without generating what comes before, and frames can be
+# decrypted apart. The stream key is derived from the binary key and a
+# random nonce kept in the file's preamble, so no two files share a
+# keystream and it never repeats within one. The derivation is scrypt, so
+# every password guessed against a file costs about 16 MB and 70 ms.
+STREAM_NONCE = 16
+_STREAM_BLOCK = 1 << 16
+KDF_N, KDF_R, KDF_P = 1 << 14, 8, 1
+
+@lru_cache(maxsize=32)
+def derive_stream_key(key, nonce):
+    return hashlib.scrypt(key.encode(), salt=b"hybcrypt-shake" + nonce, n=KDF_N, r=KDF_R, p=KDF_P, dklen=32)
+
+def shake_xor(data, key, offset=0, out=None):
+    # XOR packed bytes with the keystream of stream key `key`. `offset` is
+    # as for keystream_xor; like it, this is its own inverse.
+    if out is None:
+        out = np.empty_like(data)
+    pos = 0
+    while pos < data.size:
+        block, skip = divmod(offset + pos, _STREAM_BLOCK)
+        size = min(_STREAM_BLOCK - skip, data.size - pos)
+        stream = hashlib.shake_128(key + block.to_bytes(8, "big")).digest(skip + size)
+        np.bitwise_xor(data[pos:pos + size], np.frombuffer(stream, dtype=np.uint8, count=size, offset=skip),
+                       out=out[pos:pos + size])
+        pos += size
+    return out
+
+def _legacy_engine_key(key, nonce):
+    return key
+
+# Cipher engines, by the name the preamble records. `encrypt` and
+# `decrypt` take packed bytes, an engine key and the data's byte offset in
+# the stream, as polybius_xor_encrypt does, so a stream can be processed
+# in chunks; `engine_key(binary key, nonce)` gives the engine key, the
+# nonce being `nonce_size` random bytes made for every file. Files without
+# a cipher in the preamble (all files from before the registry) use
+# LEGACY_CIPHER, which is still selectable for writing.
+Cipher = namedtuple("Cipher", ["name", "encrypt", "decrypt", "engine_key", "nonce_size"])
+
+CIPHERS = {cipher.name: cipher for cipher in (
+    Cipher("polybius-xor", polybius_xor_encrypt, polybius_xor_decrypt, _legacy_engine_key, 0),
+    Cipher("shake128", shake_xor, shake_xor, derive_stream_key, STREAM_NONCE),
+)}
+LEGACY_CIPHER = "polybius-xor"
+DEFAULT_CIPHER = "shake128"
+
+# A cipher's name and engine key: what the encrypt and decrypt stages need,
+# and small enough to ship to worker processes
+StreamKey = namedtuple("StreamKey", ["cipher", "key"])
+
+def check_cipher(name):
+    if name not in CIPHERS:
+        raise ValueError(f"Unknown cipher {name!r}; expected one of {', '.join(CIPHERS)}")
+    return CIPHERS[name]
+
+def new_stream_key(key, cipher=DEFAULT_CIPHER):
+    # (StreamKey, nonce) for encrypting a new file with the binary key
+    cipher = check_cipher(cipher)
+    nonce = os.urandom(cipher.nonce_size) if cipher.nonce_size else None
+    return StreamKey(cipher.name, cipher.engine_key(key, nonce)), nonce
+
+def _stream_key(key):
+    # A bare binary key is the legacy Polybius + XOR cipher
+    return key if isinstance(key, StreamKey) else StreamKey(LEGACY_CIPHER, key)
+
+def stream_encrypt(data, key, offset=0):
+    key = _stream_key(key)
+    return CIPHERS[key.cipher].encrypt(data, key.key, offset)
+
+def stream_decrypt(data, key, offset=0):
+    key = _stream_key(key)
+    return CIPHERS[key.cipher].decrypt(data, key.key, offset)
+
+def binary_hybrid_encrypt(bits, key):
+    # `key` is a binary key for the legacy cipher or a StreamKey
+    nbits = bits.nbits - bits.nbits % 2
+    encrypted_data = stream_encrypt(bits.data[:(nbits + 7) // 8], key)
+    return Bits(_mask_tail(encrypted_data, nbits), nbits)
+
+def binary_hybrid_decrypt(bits, key):
+    nbits = bits.nbits - bits.nbits % 2
+    decrypted_data = stream_decrypt(bits.data[:(nbits + 7) // 8], key)
+    return Bits(_mask_tail(decrypted_data, nbits), nbits)
+
+
+
+# Lossless container formats besides GIF. PNG and APNG store the stream
+# as greyscale pixels of `density` bits (RGB bytes for density 24), so a
+# frame's packed bits are its scanlines as they are; encrypted data doesn't
+# compress, so they are deflated at PNG_LEVEL, by default 0 (stored blocks:
+# about three times faster to write than level 1 at the same size; the
+# payload's own `compression` is the place to shrink it). WebP stores lossless RGB
+# frames from Pillow's encoder, made at WEBP_METHOD (0 fastest, 6 smallest).
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_MAX_SIDE = (1 << 31) - 1
+PNG_LEVEL = 0
+# Rows read at a time from a single tall PNG
+PNG_BAND_PIXELS = 1 << 22
+WEBP_MAX_SIDE = 16384
+WEBP_METHOD = 0
+
+# A frame of a PNG or APNG file: the (offset, length) ranges of its
+# compressed data (None for the bands of a tall PNG, which are read in
+# order), its size, the density of its pixels and whether it can be read
+# on its own
+PngImage = namedtuple("PngImage", ["chunks", "size", "density", "whole"])
+
+# A frame of a WebP file: where its chunks sit, its size and whether it can
+# be read on its own
+WebpImage = namedtuple("WebpImage", ["offset", "length", "size", "whole"])
+
+def frame_heights(reso, pixels):
+    # Rows of every frame for a stream of `pixels` pixels, preamble
+    # included: full frames, then a last frame trimmed to the rows it uses
+    per_frame = reso[0] * reso[1]
+    count = max(1, -(-pixels // per_frame))
+    last = max(1, -(-(pixels - (count - 1) * per_frame) // reso[0]))
+    return [reso[1]] * (count - 1) + [last]
+
+def _open_target(target):
+    return open(target, "wb") if isinstance(target, str) else target
+
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+def _png_ihdr(width, height, density):
+    # Greyscale at `density` bits, or 8-bit RGB for density 24
+    colour, depth = (2, 8) if density == 24 else (0, density)
+    return _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, depth, colour, 0, 0, 0))
+
+def _png_rows(bits, reso, density, preamble=None):
+    # PNG scanlines for one frame's bits: a 0 (no filter) byte, then the
+    # row's pixels packed MSB-first. The frame is trimmed to the rows it
+    # uses, as in gif_frame.
+    width = reso[0]
+    row_bytes = -(-width * density // 8)
+    if preamble is None and width * density % 8 == 0:
+        # Rows are whole bytes, so the packed bits already are the pixels
+        body = bits.data
+        rows = max(1, -(-body.size // row_bytes))
+    else:
+        values = frame_values(bits, density, preamble)
+        rows = max(1, -(-len(values) // width))
+        grid = np.zeros((rows * width,) + values.shape[1:], dtype=np.uint8)
+        grid[:len(values)] = values
+        if density < 8 and row_bytes * 8 != width * density:
+            # Pad every row to whole bytes
+            padded = np.zeros((rows, row_bytes * 8 // density), dtype=np.uint8)
+            padded[:, :width] = grid.reshape(rows, width)
+            grid = padded
+        body = values_2_bits(grid.reshape(-1), density).data if density < 8 else grid.reshape(-1)
+    full = np.zeros(rows * row_bytes, dtype=np.uint8)
+    full[:body.size] = body
+    raw = np.zeros((rows, row_bytes + 1), dtype=np.uint8)
+    raw[:, 1:] = full.reshape(rows, row_bytes)
+    return raw.tobytes()
+
+def _png_frame(raw, width, density):
+    # The (pixels, palette) frame for decompressed scanlines from _png_rows
+    row_bytes = -(-width * density // 8)
+    rows = np.frombuffer(raw, dtype=np.uint8).reshape(-1, row_bytes + 1)
+    if rows[:, 0].any():
+        raise ValueError("PNG rows use filters; only PNGs written by encode can be decoded")
+    body = np.ascontiguousarray(rows[:, 1:])
+    if density == 24:
+        return body.reshape(-1, 3), None
+    values = bits_2_values(Bits(body.reshape(-1), body.size * 8), density)
+    values = values.reshape(len(rows), -1)[:, :width].reshape(-1)
+    return values, density_palette(density)
+
+def _png_layout(data):
+    # (width, height, density) from the IHDR of a PNG held in `data`
+    if data[:8] != PNG_SIGNATURE or data[12:16] != b"IHDR":
+        raise ValueError("Not a PNG file")
+    width, height, depth, colour, _, _, interlace = struct.unpack(">IIBBBBB", data[16:29])
+    if interlace or (colour, depth) not in ((0, 1), (0, 2), (0, 4), (0, 8), (2, 8)):
+        raise ValueError("Only greyscale or 8-bit RGB PNGs written by encode can be decoded")
+    return width, height, 24 if colour == 2 else depth
+
+def _png_chunks(data):
+    # (tag, data offset, length) of every chunk of a PNG held in `data`
+    pos = 8
+    while pos + 8 <= len(data):
+        length, tag = struct.unpack(">I4s", data[pos:pos + 8])
+        if pos + 12 + length > len(data):
+            raise ValueError(f"Truncated PNG chunk at byte {pos}")
+        yield tag, pos + 8, length
+        if tag == b"IEND":
+            return
+        pos += 12 + length
+
+def _is_apng(src):
+    with file_bytes(src) as data:
+        for tag, _, _ in _png_chunks(data):
+            if tag == b"acTL":
+                return True
+            if tag == b"IDAT":
+                return False
+    return False
+
+def _adler32_combine(adler1, adler2, length2):
+    # zlib's adler32_combine: the Adler-32 of two pieces from theirs
+    base = 65521
+    rem = length2 % base
+    sum1 = adler1 & 0xFFFF
+    sum2 = rem * sum1 % base
+    sum1 = (sum1 + (adler2 & 0xFFFF) + base - 1) % base
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + base - rem) % base
+    return sum1 | sum2 << 16
+
+def png_band(bits, reso, density, preamble=None):
+    # One frame of a tall PNG: its scanlines as raw deflate data ending on a
+    # byte boundary, so bands compressed apart can be joined into the one
+    # zlib stream a PNG holds, after the Adler-32 and length of the rows
+    raw = _png_rows(bits, reso, density, preamble)
+    deflate = zlib.compressobj(PNG_LEVEL, zlib.DEFLATED, -15)
+    data = deflate.compress(raw) + deflate.flush(zlib.Z_SYNC_FLUSH)
+    return struct.pack(">II", zlib.adler32(raw), len(raw)) + data
+
+def write_png(frames, reso, density, target, pixels):
+    # Write bands from png_band as a single PNG `reso[0]` wide and as tall
+    # as the stream of `pixels` pixels needs
+    height = sum(frame_heights(reso, pixels))
+    fp = _open_target(target)
+    try:
+        fp.write(PNG_SIGNATURE + _png_ihdr(reso[0], height, density))
+        # zlib header: deflate, 32K window, no preset dictionary
+        adler, data = 1, b"\x78\x01"
+        for frame in frames:
+            band_adler, length = struct.unpack(">II", frame[:8])
+            adler = _adler32_combine(adler, band_adler, length)
+            fp.write(_png_chunk(b"IDAT", data + frame[8:]))
+            data = b""
+        # An empty final block, then the checksum
+        fp.write(_png_chunk(b"IDAT", data + b"\x03\x00" + struct.pack(">I", adler)))
+        fp.write(_png_chunk(b"IEND", b""))
+    finally:
+        if fp is not target:
+            fp.close()
+    return target
+
+def scan_png(src):
+    # The logical size and the bands a single tall PNG is read in
+    with file_bytes(src) as data:
+        width, height, density = _png_layout(data)
+    band = max(1, PNG_BAND_PIXELS // width)
+    return (width, height), [PngImage(None, (width, min(band, height - row)), density, False)
+                             for row in range(0, height, band)]
+
+def iter_png_frames(src):
+    # The bands of scan_png as frames, decompressed in order
+    (width, _), bands = scan_png(src)
+    if not bands:
+        return
+    density = bands[0].density
+    band_bytes = bands[0].size[1] * (-(-width * density // 8) + 1)
+    decompress = zlib.decompressobj()
+    pending = bytearray()
+    with file_bytes(src) as data:
+        for tag, offset, length in _png_chunks(data):
+            if tag != b"IDAT":
+                continue
+            chunk = data[offset:offset + length]
+            while chunk:
+                pending += decompress.decompress(chunk, band_bytes)
+                chunk = decompress.unconsumed_tail
+                while len(pending) >= band_bytes:
+                    yield _png_frame(bytes(pending[:band_bytes]), width, density)
+                    del pending[:band_bytes]
+    pending += decompress.flush()
+    if pending:
+        yield _png_frame(bytes(pending), width, density)
+
+def apng_frame(bits, reso, density, preamble=None):
+    # One APNG frame: its scanlines as a zlib stream of their own
+    return zlib.compress(_png_rows(bits, reso, density, preamble), PNG_LEVEL)
+
+def write_apng(frames, reso, density, target, pixels):
+    # Write frames from apng_frame to an animated PNG as they arrive. The
+    # frame count goes in the header, so it comes from `pixels`, the pixels
+    # of the whole stream.
+    heights = frame_heights(reso, pixels)
+    fp = _open_target(target)
+    try:
+        canvas = reso[1] if len(heights) > 1 else heights[0]
+        fp.write(PNG_SIGNATURE + _png_ihdr(reso[0], canvas, density))
+        # Frame count, loop forever
+        fp.write(_png_chunk(b"acTL", struct.pack(">II", len(heights), 0)))
+        sequence = 0
+        for i, (frame, rows) in enumerate(zip(frames, heights)):
+            # Size, offset, 100 ms, no disposal, replace what's below
+            fp.write(_png_chunk(b"fcTL", struct.pack(">IIIIIHHBB", sequence, reso[0], rows, 0, 0, 1, 10, 0, 0)))
+            sequence += 1
+            if i == 0:
+                fp.write(_png_chunk(b"IDAT", frame))
+            else:
+                fp.write(_png_chunk(b"fdAT", struct.pack(">I", sequence) + frame))
+                sequence += 1
+        fp.write(_png_chunk(b"IEND", b""))
+    finally:
+        if fp is not target:
+            fp.close()
+    return target
+
+def scan_apng(src):
+    # The canvas size and a PngImage for every frame of an APNG
+    images = []
+    with file_bytes(src) as data:
+        width, height, density = _png_layout(data)
+        size, whole, chunks = None, False, []
+        for tag, offset, length in _png_chunks(data):
+            if tag in (b"fcTL", b"IEND") and size is not None:
+                images.append(PngImage(tuple(chunks), size, density, whole))
+                size, chunks = None, []
+            if tag == b"fcTL":
+                w, h, x, y = struct.unpack(">IIII", data[offset + 4:offset + 20])
+                size, whole = (w, h), (x, y, w) == (0, 0, width) and h <= height
+            elif tag == b"IDAT" and size is not None:
+                chunks.append((offset, length))
+            elif tag == b"fdAT":
+                chunks.append((offset + 4, length - 4))
+    return (width, height), images
+
+def read_apng_frame(src, image):
+    with file_bytes(src) as data:
+        raw = [data[offset:offset + length] for offset, length in image.chunks]
+    return _png_frame(zlib.decompress(b"".join(raw)), image.size[0], image.density)
+
+def iter_apng_frames(src):
+    _, images = scan_apng(src)
+    return (read_apng_frame(src, image) for image in images)
+
+def webp_frame(bits, reso, density, preamble=None):
+    # One frame as the chunks of a lossless WebP image, trimmed to the rows
+    # it uses
+    values = frame_values(bits, density, preamble)
+    rows = max(1, -(-len(values) // reso[0]))
+    pixels = np.zeros((rows * reso[0], 3), dtype=np.uint8)
+    pixels[:len(values)] = values_2_pixels(values, density)
+    out = io.BytesIO()
+    Image.fromarray(pixels.reshape(rows, reso[0], 3), "RGB").save(out, "WEBP", lossless=True, quality=0,
+                                                                   method=WEBP_METHOD)
+    data = out.getvalue()
+    if data[12:16] != b"VP8L":
+        raise OSError("WebP encoder did not write a lossless image")
+    return data[12:]
+
+def write_webp(frames, reso, density, target, pixels):
+    # Write frames from webp_frame to an animated WebP. The RIFF header
+    # holds the file size, so it is filled in at the end, in place when the
+    # target can seek and otherwise by writing the file from memory.
+    heights = frame_heights(reso, pixels)
+    fp = _open_target(target)
+    try:
+        out = fp if getattr(fp, "seekable", lambda: False)() else io.BytesIO()
+        start = out.tell()
+        canvas = reso[1] if len(heights) > 1 else heights[0]
+        out.write(b"RIFF\0\0\0\0WEBP")
+        # Animation flag and the canvas size
+        out.write(b"VP8X" + struct.pack("<I", 10) + b"\x02\0\0\0" +
+                  (reso[0] - 1).to_bytes(3, "little") + (canvas - 1).to_bytes(3, "little"))
+        # Black background, loop forever
+        out.write(b"ANIM" + struct.pack("<IIH", 6, 0, 0))
+        for frame, rows in zip(frames, heights):
+            # At the top left, 100 ms, no blending or disposal
+            header = (bytes(6) + (reso[0] - 1).to_bytes(3, "little") + (rows - 1).to_bytes(3, "little") +
+                      (100).to_bytes(3, "little") + b"\x02")
+            body = header + frame
+            out.write(b"ANMF" + struct.pack("<I", len(body)) + body + b"\0" * (len(body) % 2))
+        end = out.tell()
+        if end - start - 8 >= 1 << 32:
+            raise ValueError("WebP files are limited to 4 GB")
+        out.seek(start + 4)
+        out.write(struct.pack("<I", end - start - 8))
+        out.seek(end)
+        if out is not fp:
+            fp.write(out.getbuffer())
+    finally:
+        if fp is not target:
+            fp.close()
+    return target
+
+def scan_webp(src):
+    # The canvas size and a WebpImage for every frame of a WebP file
+    images = []
+    with file_bytes(src) as data:
+        if data[:4] != b"RIFF" or data[8:12] != b"WEBP":
+            raise ValueError(f"{src} is not a WebP file")
+        width = height = None
+        pos = 12
+        while pos + 8 <= len(data):
+            tag = data[pos:pos + 4]
+            length, = struct.unpack("<I", data[pos + 4:pos + 8])
+            body = pos + 8
+            if tag == b"VP8X":
+                width = int.from_bytes(data[body + 4:body + 7], "little") + 1
+                height = int.from_bytes(data[body + 7:body + 10], "little") + 1
+            elif tag == b"ANMF":
+                x, y, w, h = (int.from_bytes(data[body + i:body + i + 3], "little") for i in (0, 3, 6, 9))
+                size = (w + 1, h + 1)
+                whole = (x, y) == (0, 0) and width == size[0] and size[1] <= height
+                images.append(WebpImage(body + 16, length - 16, size, whole))
+            elif tag == b"VP8L" and not images:
+                # A still image
+                bits, = struct.unpack("<I", data[body + 1:body + 5])
+                width, height = (bits & 0x3FFF) + 1, (bits >> 14 & 0x3FFF) + 1
+                images.append(WebpImage(pos, length + 8, (width, height), True))
+            pos = body + length + length % 2
+    return (width, height), images
+
+def read_webp_frame(src, image):
+    with file_bytes(src) as webp:
+        data = webp[image.offset:image.offset + image.length]
+    with Image.open(io.BytesIO(b"RIFF" + struct.pack("<I", len(data) + 4) + b"WEBP" + data)) as im:
+        return np.asarray(im.convert("RGB")).reshape(-1, 3), None
+
+def iter_webp_frames(src):
+    _, images = scan_webp(src)
+    return (read_webp_frame(src, image) for image in images)
+
+def gif_container_frame(bits, reso, density, preamble=None):
+    return gif_frame(frame_values(bits, density, preamble), reso, density)
+
+def write_gif_container(frames, reso, density, target, pixels):
+    return write_gif(frames, reso, density, target)
+
+def scan_gif_container(src):
+    # scan_gif, with only the images decode_gif_image can read marked whole
+    screen, images = scan_gif(src)
+    return screen, [image._replace(whole=image.whole and image.palette is not None) for image in images]
+
+# A format the frames are stored in. When encoding, `frame` renders and
+# compresses one frame's bits (in a worker process with workers other than
+# 1) and `write` assembles the frames into the file. When decoding, `scan`
+# returns the logical size and a record for every frame, with its `size`
+# and whether it is `whole`: readable with `read` on its own, without the
+# frames before it. `iter_frames` reads every frame in order. Frames come
+# back in the (pixels, palette) form of iter_gif_frames.
+Container = namedtuple("Container", ["name", "suffix", "mime", "densities", "max_side",
+                                     "frame", "write", "scan", "read", "iter_frames"])
+
+CONTAINERS = {container.name: container for container in (
+    Container("gif", ".gif", "image/gif", GIF_DENSITIES, GIF_MAX_SIDE,
+              gif_container_frame, write_gif_container, scan_gif_container, decode_gif_image, iter_gif_frames),
+    Container("apng", ".apng", "image/apng", DENSITIES, PNG_MAX_SIDE,
+              apng_frame, write_apng, scan_apng, read_apng_frame, iter_apng_frames),
+    Container("png", ".png", "image/png", DENSITIES, PNG_MAX_SIDE,
+              png_band, write_png, scan_png, None, iter_png_frames),
+    Container("webp", ".webp", "image/webp", DENSITIES, WEBP_MAX_SIDE,
+              webp_frame, write_webp, scan_webp, read_webp_frame, iter_webp_frames),
+)}
+
+def check_container(name, density=1):
+    # The Container called `name`, if it holds `density` bits per pixel
+    if name not in CONTAINERS:
+        raise ValueError(f"Unknown container {name!r}; expected one of {', '.join(CONTAINERS)}")
+    container = CONTAINERS[name]
+    if density not in container.densities:
+        raise ValueError(f"{name} frames hold {', '.join(map(str, container.densities))} bits per pixel, "
+                         f"not {density}")
+    return container
+
+def detect_container(src):
+    # The Container of an encoded file, from its first bytes
+    with file_bytes(src) as data:
+        head = data[:12]
+    if head[:4] == b"GIF8":
+        return CONTAINERS["gif"]
+    if head[:8] == PNG_SIGNATURE:
+        return CONTAINERS["apng" if _is_apng(src) else "png"]
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return CONTAINERS["webp"]
+    raise ValueError(f"{src} is not a GIF, PNG or WebP file")
+
+def scan_frames(src):
+    # The logical size and frame records of an encoded file of any container
+    return detect_container(src).scan(src)
+
+def iter_frame_bits(chunks, res, density=1, preamble=None):
+    # The part of the encrypted stream each frame carries. The first frame
+    # has room for the preamble in front.
+    per_frame = res[0] * res[1]
+    first = per_frame
+    if preamble is not None:
+        if preamble.nbits >= per_frame:
+            raise ValueError("Frames are too small to hold the format preamble")
+        first -= preamble.nbits
+    return rebatch_bits(chunks, per_frame * density, first * density)
+
+def frame_values(bits, density=1, preamble=None):
+    # Pixel values for one frame's bits. A preamble goes in front at one bit
+    # per pixel, using the darkest and brightest values.
+    values = bits_2_values(bits, density)
+    if preamble is None:
+        return values
+    lead = bits_2_values(preamble) * np.uint8(255 if density == 24 else 2 ** density - 1)
+    if density == 24:
+        lead = np.repeat(lead[:, None], 3, axis=1)
+    return np.concatenate([lead, values])
+
+def _encode_frame(job):
+    container, bits, reso, density, preamble = job
+    return CONTAINERS[container].frame(bits, reso, density, preamble)
+
+def iter_frames_encoded(chunks, res, density=1, preamble=None, workers=1, container="gif"):
+    # Encoded frames of the named container for a stream of encrypted Bits
+    # chunks. With workers other than 1, frames are rendered and compressed
+    # in a process pool; each job ships only the frame's packed bits, and
+    # the output is the same as the serial path.
+    jobs = (
+        (container, bits, res, density, preamble if i == 0 else None)
+        for i, bits in enumerate(iter_frame_bits(chunks, res, density, preamble))
     )
-    
-    return decrypted_data
+    if workers == 1:
+        return map(_encode_frame, jobs)
+    return ordered_pool_map(_encode_frame, jobs, workers)
+
+def frame_count(stream_nbits, res, density=1, preamble=None):
+    # Number of frames encode writes for a stream of `stream_nbits` bits
+    pixels = -(-stream_nbits // density) + (0 if preamble is None else preamble.nbits)
+    return max(1, -(-pixels // (res[0] * res[1])))
 
+def write_frames(chunks, res, density, preamble, workers, target, progress, stream_nbits, container):
+    # The "frames" stage of encode and encode_stream: render, compress and
+    # write every frame of a `stream_nbits` bit stream, reporting the bytes
+    # written so far
+    _check_res(res, container.max_side)
+    total_frames = frame_count(stream_nbits, res, density, preamble)
+    pixels = -(-stream_nbits // density) + (0 if preamble is None else preamble.nbits)
+    with progress_stage(progress, "frames", total_frames) as report:
+        frames = iter_frames_encoded(chunks, res, density, preamble, workers, container.name)
+        if progress is not None:
+            frames = _reported(frames, report, len)
+        return container.write(frames, res, density, target, pixels)
 
+def encode(src,key, res, in_memory=False, density=1, workers=1, progress=None, compression=None,
+           integrity=True, target=None, container="gif", cipher=DEFAULT_CIPHER):
+    # Frames go straight from memory into the writer of `container`, one of
+    # CONTAINERS (GIF by default). The file is written to `target`, a path or
+    # writable file object, by default "<name>.gif" (or the container's
+    # suffix) in the working directory, and `target` returned; with in_memory=True
+    # it is returned as a BytesIO positioned at the start. Frames are `res`
+    # sized, or with res="auto" sized to the payload (see auto_res); the
+    # last frame is trimmed to the rows it uses. `density` is the number of bits
+    # stored per pixel; `workers` the number of processes encoding frames
+    # (None for one per CPU). `progress` gets a Progress at the start and
+    # end of the "read", "cipher" and "frames" stages and for every frame.
+    # `compression` is None, "auto" or one of COMPRESSIONS. With integrity
+    # (the default) the GIF carries a key check value and payload digest;
+    # integrity=False leaves them out. `cipher` is one of CIPHERS, recorded
+    # in the preamble; LEGACY_CIPHER writes files older readers can decode.
+    container = check_container(container, density)
+    compression = check_compression(compression)
+    stream_key, nonce = new_stream_key(key, cipher)
+    with progress_stage(progress, "read") as report:
+        bits = file_2_bits(src)
+        report(0, bits.data.size)
+        digest = hashlib.blake2b(bits.data, digest_size=DIGEST_SIZE).digest() if integrity else None
+        if compression == "auto":
+            compression = auto_compression(bits.data)
+        if compression is not None:
+            data = np.frombuffer(compress_bytes(bits.data.tobytes(), compression), dtype=np.uint8)
+            bits = Bits(data, data.size * 8)
+        payload_nbits = bits.nbits
+        header = header_bits(os.path.basename(src), payload_nbits, digest)
+        bits = _pad_even(join_bits([header, bits]))
+        options = dict(compression=compression, key_check=make_key_check(key) if integrity else None,
+                       digest=integrity, cipher=stream_key.cipher, nonce=nonce)
+        res = frame_res(res, density, bits.nbits, **options)
+        preamble = indexed_preamble(res, density, bits.nbits, header.nbits, payload_nbits, **options)
 
-def encode(src,key, res):
-    bits = file_2_bits(src)
-    bits = add_header(bits, os.path.basename(src))
+    with progress_stage(progress, "cipher") as report:
+        bits = binary_hybrid_encrypt(bits, stream_key)
+        report(0, bits.data.size)
 
-    bits =  polybius_cipher_binary(bits)
+    if in_memory:
+        target = io.BytesIO()
+    elif target is None:
+        target = f"{os.path.basename(src)}{container.suffix}"
+    write_frames([bits], res, density, preamble, workers, target, progress, bits.nbits, container)
+    if in_memory:
+        target.seek(0)
+    return target
 
-    bits = binary_vigenere_encrypt(bits,key)
+def iter_encrypted_chunks(src, key, chunk_size=1 << 20, fname=None, digest=None):
+    # The header + payload stream that encode builds, encrypted with `key`
+    # (a StreamKey, or a binary key for the legacy Polybius and XOR
+    # stages), produced from `chunk_size` byte reads of `src`.
+    # Every chunk except the last holds whole bytes; an odd final bit is
+    # padded, as _pad_even does. The header names
+    # `fname`, by default the name of `src`, and carries `digest`.
+    def read_chunks():
+        yield header_bits(fname or os.path.basename(src), os.path.getsize(src) * 8, digest)
+        with open(src, "rb") as f:
+            while True:
+                chunk = np.fromfile(f, dtype=np.uint8, count=chunk_size)
+                if not chunk.size:
+                    break
+                yield Bits(chunk, chunk.size * 8)
 
-    pixels = bits_2_pixels(bits)
-    pixels_per_image = res[0] * res[1]
-    num_imgs = (len(pixels) + pixels_per_image - 1) // pixels_per_image
-    clear_folder("temp")
-    for i in range(num_imgs):
-        cur_temp_name = f"temp/{os.path.basename(src)}-{i}.png"
-        cur_start_idx = i * pixels_per_image
-        cur_pixels = pixels[cur_start_idx:cur_start_idx + pixels_per_image]
-        pixels_2_png(cur_pixels, cur_temp_name)
-    return make_gif("temp", os.path.basename(src))
+    offset = 0
+    for piece in align_bits(read_chunks()):
+        nbits = piece.nbits + piece.nbits % 2
+        if nbits:
+            data = stream_encrypt(piece.data[:(nbits + 7) // 8], key, offset)
+            offset += piece.nbits // 8
+            yield Bits(_mask_tail(data, nbits), nbits)
+
+def rebatch_bits(chunks, nbits, first=None):
+    # Regroup a stream of Bits chunks into pieces of exactly `nbits` bits,
+    # or `first` bits for the first piece; the last piece holds whatever
+    # is left
+    size = nbits if first is None else first
+    pending, count = [], 0
+    for chunk in chunks:
+        pending.append(chunk)
+        count += chunk.nbits
+        while count >= size:
+            joined = join_bits(pending)
+            yield slice_bits(joined, 0, size)
+            rest = slice_bits(joined, size, count - size)
+            pending, count = [rest], rest.nbits
+            size = nbits
+    if count:
+        yield join_bits(pending)
+
+def encode_stream(src, key, res, target=None, chunk_size=1 << 20, density=1, workers=1, progress=None,
+                  compression=None, integrity=True, workdir=None, container="gif", cipher=DEFAULT_CIPHER):
+    # Constant-memory version of encode for inputs that don't fit in RAM.
+    # The source is read, encrypted and cut into frames chunk by chunk, and
+    # every frame is appended to the file as soon as it is full, so at most
+    # about one frame is held in memory. Frames are `res` sized, or sized
+    # to the payload with res="auto", and stored in `container`, as in
+    # encode. Returns `target`, by default "<name>.gif". Reading and encryption happen
+    # inside the "frames" stage, the only one reported to `progress`. With
+    # `compression` the source is first compressed to a temporary file in
+    # `workdir`, by default the directory of `target`. With integrity the source is read once more up
+    # front for its digest. `cipher` is as for encode.
+    container = check_container(container, density)
+    compression = check_compression(compression)
+    cipher = check_cipher(cipher).name
+    if target is None:
+        target = f"{os.path.basename(src)}{container.suffix}"
+    if compression == "auto":
+        with open(src, "rb") as f:
+            compression = auto_compression(f.read(AUTO_SAMPLE))
+    integrity = (make_key_check(key), file_digest(src, chunk_size)) if integrity else (None, None)
+    if compression is None:
+        return _encode_stream(src, key, res, target, chunk_size, density, workers, progress, None, integrity,
+                              container, cipher)
+    if workdir is None and isinstance(target, str):
+        workdir = os.path.dirname(target)
+    with tempfile.NamedTemporaryFile(dir=workdir or None, suffix=".tmp", delete=False) as packed:
+        try:
+            compress_file(src, compression, packed, chunk_size)
+            packed.close()
+            return _encode_stream(packed.name, key, res, target, chunk_size, density, workers, progress,
+                                  compression, integrity, container, cipher, fname=os.path.basename(src))
+        finally:
+            os.remove(packed.name)
+
+def _encode_stream(src, key, res, target, chunk_size, density, workers, progress, compression, integrity,
+                   container, cipher, fname=None):
+    key_check, digest = integrity
+    stream_key, nonce = new_stream_key(key, cipher)
+    fname = fname or os.path.basename(src)
+    payload_nbits = os.path.getsize(src) * 8
+    header_nbits = header_bits(fname, payload_nbits, digest).nbits
+    stream_nbits = header_nbits + payload_nbits
+    options = dict(compression=compression, key_check=key_check, digest=digest is not None, cipher=cipher,
+                   nonce=nonce)
+    res = frame_res(res, density, stream_nbits + stream_nbits % 2, **options)
+    preamble = indexed_preamble(res, density, stream_nbits + stream_nbits % 2, header_nbits, payload_nbits,
+                                **options)
+    chunks = iter_encrypted_chunks(src, stream_key, chunk_size, fname=fname, digest=digest)
+    return write_frames(chunks, res, density, preamble, workers, target, progress, stream_nbits + stream_nbits % 2,
+                        container)
 
 
 def conversion_test():
@@ -232,8 +1942,6 @@ def conversion_test():
     bits_2_file(bits, f"{src_f.split('.')[0]}-copy.{src_f.split('.')[1]}")
     test_bit_similarity(file_2_bits(src_f), bits)
 
-import os
-
 def convert_all_bin_to_jpg(input_folder, output_folder="recovered"):
     # Ensure the output folder exists
     os.makedirs(output_folder, exist_ok=True)
@@ -0,0 +1,211 @@
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import codee
+
+# Batch front end for codee:
+#   python hybridcrypt.py encode -k key -o encoded data/
+#   python hybridcrypt.py decode -k key -o recovered "encoded/*.gif"
+#   python hybridcrypt.py encode -k key -f png -d 24 data/
+# Every input is a file, a directory or a glob pattern. Files are processed
+# in parallel, each job in its own scratch directory, and a throughput line
+# is printed per file followed by a total. Files found in a directory keep
+# their path below it in the output directory, so in/a/x.bin and in/b/x.bin
+# become encoded/a/x.bin.gif and encoded/b/x.bin.gif; a file that would
+# still overwrite another one's output fails instead.
+
+RESOLUTIONS = {"4k": codee.four_k, "hd": codee.HD}
+
+def ascii_key_to_binary(key):
+    # Same key expansion as the Streamlit app in main.py
+    return ''.join(format(ord(char), '08b') for char in key)
+
+def parse_res(text):
+    if text.lower() == codee.AUTO_RES:
+        return codee.AUTO_RES
+    if text.lower() in RESOLUTIONS:
+        return RESOLUTIONS[text.lower()]
+    try:
+        width, height = (int(part) for part in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected auto, 4k, hd or WIDTHxHEIGHT, got {text!r}")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"resolution must be positive, got {text!r}")
+    return width, height
+
+def expand_inputs(patterns, suffix=None):
+    # (absolute path, output name) of every input file. Files named directly
+    # are always kept and named by their base name; files found in
+    # directories are filtered by suffix (any container's when decoding) and
+    # named by their path below the directory.
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if os.path.isdir(path):
+                for root, _, names in sorted(os.walk(path)):
+                    files += [(os.path.join(root, name), os.path.relpath(os.path.join(root, name), path))
+                              for name in sorted(names) if suffix is None or name.lower().endswith(suffix)]
+            elif os.path.isfile(path):
+                files.append((path, os.path.basename(path)))
+            else:
+                print(f"hybridcrypt: no such file: {path}", file=sys.stderr)
+    # Keep the first occurrence of files matched more than once
+    first = {}
+    for path, name in files:
+        first.setdefault(os.path.abspath(path), name)
+    return list(first.items())
+
+def encode_job(job):
+    # Encrypt one file into its output path, e.g. <out>/name.gif.
+    # The image is built in a scratch directory and only moved into place
+    # once complete.
+    src, target, key, res, density, workers, compression, integrity, container, cipher = job
+    start = time.perf_counter()
+    with codee.job_workspace(os.path.dirname(target)) as scratch:
+        image = os.path.join(scratch, os.path.basename(target))
+        codee.encode_stream(src, key, res, target=image, density=density, workers=workers, compression=compression,
+                            integrity=integrity, workdir=scratch, container=container, cipher=cipher)
+        frames = len(codee.scan_frames(image)[1])
+        os.replace(image, target)
+    return target, os.path.getsize(src), frames, time.perf_counter() - start
+
+def decode_job(job):
+    # Recover one image into a scratch directory in `out`, its output
+    # directory, checking its digest. The recovered file's name is only
+    # known now, so place_recovered moves it into place afterwards.
+    src, out, key, _, _, workers, _, _, _, _ = job
+    start = time.perf_counter()
+    os.makedirs(out, exist_ok=True)
+    scratch = tempfile.mkdtemp(prefix="hybridcrypt-", dir=out)
+    try:
+        recovered = codee.decode(src, key, workers=workers, out_dir=scratch)
+    except BaseException:
+        shutil.rmtree(scratch, ignore_errors=True)
+        raise
+    frames = len(codee.scan_frames(src)[1])
+    return recovered, os.path.getsize(recovered), frames, time.perf_counter() - start
+
+def place_recovered(result, outputs):
+    # Move a file decode_job recovered into its output directory, unless an
+    # earlier file of this run went to the same path; `outputs` maps the
+    # paths written so far to their inputs
+    recovered, nbytes, frames, seconds = result
+    scratch = os.path.dirname(recovered)
+    try:
+        target = os.path.join(os.path.dirname(scratch), os.path.basename(recovered))
+        if target in outputs:
+            raise FileExistsError(f"{target} was already recovered from {outputs[target]}")
+        os.replace(recovered, target)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return target, nbytes, frames, seconds
+
+def run_jobs(fn, jobs, processes):
+    # Yields (job, result or exception) as jobs finish
+    if processes == 1:
+        for job in jobs:
+            try:
+                yield job, fn(job)
+            except Exception as e:
+                yield job, e
+        return
+    with ProcessPoolExecutor(processes) as pool:
+        futures = {pool.submit(fn, job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+def throughput(nbytes, frames, seconds):
+    seconds = max(seconds, 1e-9)
+    return f"{nbytes / seconds / 1e6:8.2f} MB/s {frames / seconds:8.2f} frames/s"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="hybridcrypt", description="Encode files into GIFs (or PNG/WebP) or decode them back, in batches.")
+    parser.add_argument("mode", choices=["encode", "decode"])
+    parser.add_argument("inputs", nargs="+", help="files, directories or glob patterns")
+    parser.add_argument("-k", "--key", required=True, help="ASCII key")
+    parser.add_argument("-o", "--out", help="output directory (default: encoded/ or recovered_files/)")
+    parser.add_argument("-r", "--res", type=parse_res, default=codee.AUTO_RES,
+                        help="frame size: auto (sized to each file), 4k, hd or WIDTHxHEIGHT (default auto)")
+    parser.add_argument("-d", "--density", type=int, choices=codee.DENSITIES, default=1,
+                        help="bits per pixel when encoding (24 needs a PNG or WebP container)")
+    parser.add_argument("-f", "--container", choices=list(codee.CONTAINERS), default="gif",
+                        help="image format when encoding (default gif)")
+    parser.add_argument("-c", "--compress", choices=("none", "auto") + codee.COMPRESSIONS, default="none",
+                        help="compress files before encrypting them (default none)")
+    parser.add_argument("--cipher", choices=list(codee.CIPHERS), default=codee.DEFAULT_CIPHER,
+                        help=f"cipher when encoding (default {codee.DEFAULT_CIPHER}; {codee.LEGACY_CIPHER} "
+                             "for files older versions can decode)")
+    parser.add_argument("--no-integrity", dest="integrity", action="store_false",
+                        help="leave out the key check value and payload digest")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="files processed in parallel (default: one per CPU)")
+    parser.add_argument("-w", "--frame-workers", type=int, default=1, help="processes per file for frame encoding/decoding")
+    args = parser.parse_args(argv)
+
+    encoding = args.mode == "encode"
+    if encoding:
+        try:
+            codee.check_container(args.container, args.density)
+        except ValueError as e:
+            parser.error(str(e))
+    suffixes = tuple(container.suffix for container in codee.CONTAINERS.values())
+    files = expand_inputs(args.inputs, suffix=None if encoding else suffixes)
+    if not files:
+        parser.error("no input files")
+    out = os.path.abspath(args.out or ("encoded" if encoding else "recovered_files"))
+    os.makedirs(out, exist_ok=True)
+
+    key = ascii_key_to_binary(args.key)
+    # Each job's output path when encoding, output directory when decoding
+    if encoding:
+        outputs = [os.path.join(out, name + codee.CONTAINERS[args.container].suffix) for _, name in files]
+    else:
+        outputs = [os.path.join(out, os.path.dirname(name)) for _, name in files]
+    jobs = [(src, output, key, args.res, args.density, args.frame_workers, args.compress, args.integrity,
+             args.container, args.cipher) for (src, _), output in zip(files, outputs)]
+
+    total_bytes = total_frames = failed = 0
+    written = {}
+    if encoding:
+        # Inputs whose output path another input already has fail up front
+        for job in list(jobs):
+            if job[1] in written:
+                failed += 1
+                jobs.remove(job)
+                print(f"FAILED {job[0]}: {job[1]} is already the output of {written[job[1]]}", file=sys.stderr)
+            else:
+                written[job[1]] = job[0]
+    processes = max(1, min(args.jobs, len(jobs)))
+
+    start = time.perf_counter()
+    for job, result in run_jobs(encode_job if encoding else decode_job, jobs, processes):
+        if not encoding and not isinstance(result, Exception):
+            try:
+                result = place_recovered(result, written)
+                written[result[0]] = job[0]
+            except OSError as e:
+                result = e
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"FAILED {job[0]}: {result}", file=sys.stderr)
+            continue
+        target, nbytes, frames, seconds = result
+        total_bytes += nbytes
+        total_frames += frames
+        print(f"{throughput(nbytes, frames, seconds)} {seconds:8.2f}s  {job[0]} -> {target}")
+    elapsed = time.perf_counter() - start
+    print(f"{throughput(total_bytes, total_frames, elapsed)} {elapsed:8.2f}s  "
+          f"total: {len(files) - failed} of {len(files)} files, {total_bytes} bytes, {total_frames} frames")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import itertools
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from multiprocessing import get_context
+
+import codee
+
+# Process-wide background queue for encode and decode jobs, shared by every
+# session of the Streamlit apps. Jobs run in a pool of at most MAX_JOBS
+# worker processes, created on first use, so a burst of uploads queues up
+# instead of oversubscribing the CPU. Workers report progress through the
+# codec's progress callback into a managed dict the UI polls, and a job is
+# cancelled by flagging it; its callback raises JobCancelled at the next
+# frame.
+MAX_JOBS = int(os.environ.get("HYBRIDCRYPT_JOBS", os.cpu_count() or 1))
+
+# state is "queued", "running", "done", "failed" or "cancelled"; fraction
+# runs from 0 to 1; result is what encode/decode returned
+JobStatus = namedtuple("JobStatus", ["state", "fraction", "stage", "result", "error"])
+
+class JobCancelled(Exception):
+    pass
+
+_lock = threading.Lock()
+_pool = None
+_manager = None
+_progress = None
+_cancelled = None
+_jobs = {}
+_ids = itertools.count(1)
+
+def _start():
+    # The pool and the manager holding the shared dicts, created once
+    global _pool, _manager, _progress, _cancelled
+    if _pool is None:
+        context = get_context("spawn")
+        _manager = context.Manager()
+        _progress = _manager.dict()
+        _cancelled = _manager.dict()
+        _pool = ProcessPoolExecutor(MAX_JOBS, mp_context=context)
+
+def _run(job_id, kind, args, kwargs, progress, cancelled):
+    # Runs in a worker process
+    def report(event):
+        if cancelled.get(job_id):
+            raise JobCancelled()
+        if event.total_frames:
+            progress[job_id] = (event.stage, event.frames / event.total_frames)
+        else:
+            progress[job_id] = (event.stage, 0.0)
+
+    progress[job_id] = ("starting", 0.0)
+    fn = codee.encode if kind == "encode" else codee.decode
+    return fn(*args, progress=report, **kwargs)
+
+def submit(kind, *args, **kwargs):
+    # Queue codee.encode(*args, **kwargs) or codee.decode(...); returns a
+    # job id. Outputs should go to a path of the caller's, e.g. a
+    # job_workspace, since in_memory results can't leave the worker.
+    if kind not in ("encode", "decode"):
+        raise ValueError(f"Job kind is encode or decode, not {kind!r}")
+    with _lock:
+        _start()
+        job_id = next(_ids)
+        _jobs[job_id] = _pool.submit(_run, job_id, kind, args, kwargs, _progress, _cancelled)
+    return job_id
+
+def status(job_id):
+    future = _jobs[job_id]
+    stage, fraction = _progress.get(job_id, (None, 0.0))
+    if future.cancelled():
+        return JobStatus("cancelled", fraction, stage, None, None)
+    if not future.done():
+        return JobStatus("running" if job_id in _progress else "queued", fraction, stage, None, None)
+    error = future.exception()
+    if isinstance(error, JobCancelled):
+        return JobStatus("cancelled", fraction, stage, None, None)
+    if error is not None:
+        return JobStatus("failed", fraction, stage, None, error)
+    return JobStatus("done", 1.0, stage, future.result(), None)
+
+def cancel(job_id):
+    # Queued jobs are dropped; running ones stop at their next frame
+    _cancelled[job_id] = True
+    _jobs[job_id].cancel()
+
+def forget(job_id):
+    # Drop a finished job's bookkeeping
+    with _lock:
+        _jobs.pop(job_id, None)
+    _progress.pop(job_id, None)
+    _cancelled.pop(job_id, None)
+
+def wait(job_id, timeout=None):
+    # Block until the job finishes; returns its status
+    try:
+        _jobs[job_id].exception(timeout)
+    except CancelledError:
+        pass
+    return status(job_id)
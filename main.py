@@ -1,18 +1,32 @@
 import streamlit as st
 import os
 from PIL import Image
-import shutil
-from codee import encode, decode, convert_all_bin_to_jpg
+import tempfile
+from codee import CONTAINERS, encode, decode, job_workspace
+from result_cache import cache_key, cached, content_hash
 
 def ascii_key_to_binary(key):
     
     return ''.join(format(ord(char), '08b') for char in key)
 
-# Helper function to clear temporary folders
-def clear_temp_folders():
-    for folder in ["temp", "recovered_files", "recovered"]:
-        shutil.rmtree(folder, ignore_errors=True)
-        os.makedirs(folder, exist_ok=True)
+# Progress callback for codee.encode/decode that drives a Streamlit progress bar
+def progress_bar(label):
+    bar = st.progress(0.0, text=label)
+
+    def update(event):
+        if event.total_frames:
+            done = min(event.frames / event.total_frames, 1.0)
+            bar.progress(done, text=f"{label} frame {event.frames} of {event.total_frames} ({event.elapsed:.1f}s)")
+
+    return update
+
+# Private scratch directory for this browser session. Each job gets its own
+# directory inside it, so concurrent sessions never touch each other's
+# files; it is removed when the session ends or the server exits.
+def session_workspace():
+    if "workspace" not in st.session_state:
+        st.session_state["workspace"] = tempfile.TemporaryDirectory(prefix="hybridcrypt-session-")
+    return st.session_state["workspace"].name
 
 # Set up the Streamlit app
 st.set_page_config(page_title="File to GIF Encoder/Decoder", layout="centered")
@@ -28,77 +42,110 @@ with tab1:
 
     resolution = st.selectbox(
         "Select GIF Resolution",
-        options=["4K (3840x2160)", "HD (1920x1080)"],
-        index=1
+        options=["Auto (fit to file)", "4K (3840x2160)", "HD (1920x1080)"],
+        index=0
     )
 
     res_map = {
+        "Auto (fit to file)": "auto",
         "4K (3840x2160)": (3840, 2160),
         "HD (1920x1080)": (1920, 1080)
     }
     res = res_map[resolution]
 
+    container = st.selectbox(
+        "Image format",
+        options=list(CONTAINERS),
+        index=0,
+        help="GIF opens anywhere; PNG, APNG and WebP are smaller, faster and also take 24 bits per pixel."
+    )
+
+    density = st.selectbox(
+        "Bits per pixel",
+        options=list(CONTAINERS[container].densities),
+        index=0,
+        help="Higher densities need fewer frames."
+    )
+
+    compression = st.selectbox(
+        "Compression",
+        options=["none", "auto", "zlib", "lzma"],
+        index=0,
+        help="Compressing text and other redundant files first needs fewer frames; auto skips files that don't shrink."
+    )
+
     key = st.text_input("Enter Vigenère Cipher Key (ASCII):", value="key")
     binary_key = ascii_key_to_binary(key)
 
     if st.button("Encode"):
         if uploaded_file is not None:
-            clear_temp_folders()
-            input_file_path = os.path.join("temp", uploaded_file.name)
-            with open(input_file_path, "wb") as f:
-                f.write(uploaded_file.read())
-            
-            st.write("Encoding in progress...")
+            content = uploaded_file.getvalue()
+            result_key = cache_key("codee-encode", content_hash(content), uploaded_file.name,
+                                   binary_key, res, density, compression, container)
+
+            def encode_upload():
+                with job_workspace(session_workspace()) as work:
+                    input_file_path = os.path.join(work, os.path.basename(uploaded_file.name))
+                    with open(input_file_path, "wb") as f:
+                        f.write(content)
+                    gif = encode(input_file_path, binary_key, res, in_memory=True, density=density,
+                                 compression=compression, progress=progress_bar("Encoding"), container=container)
+                    return gif.getvalue(), {}
+
             try:
-                gif_path = encode(input_file_path, binary_key ,res)
-                st.success("Encoding completed!")
-                st.image(gif_path, caption="Encoded GIF")
-                st.download_button("Download Encoded GIF", data=open(gif_path, "rb"), file_name=os.path.basename(gif_path))
+                gif_bytes, _ = cached(result_key, encode_upload)
+                # Kept in the session so reruns (e.g. clicking download) show it again
+                st.session_state["encoded"] = (uploaded_file.name + CONTAINERS[container].suffix, gif_bytes)
             except Exception as e:
                 st.error(f"Error during encoding: {e}")
         else:
             st.warning("Please upload a file to encode.")
 
+    if "encoded" in st.session_state:
+        name, gif_bytes = st.session_state["encoded"]
+        st.success("Encoding completed!")
+        st.image(gif_bytes, caption="Encoded image")
+        st.download_button("Download Encoded Image", data=gif_bytes, file_name=name)
+
 # Decode Tab
 with tab2:
     st.header("Decode a GIF into its Original File")
-    uploaded_gif = st.file_uploader("Upload a GIF to decode", type=["gif"])
+    uploaded_gif = st.file_uploader("Upload a GIF to decode", type=[name for name in CONTAINERS])
 
     key = st.text_input("Enter Vigenère Cipher Key (ASCII):", value="secret")
     binary_key = ascii_key_to_binary(key)
 
     if st.button("Decode"):
         if uploaded_gif is not None:
-            clear_temp_folders()
-            gif_path = os.path.join("temp", uploaded_gif.name)
-            with open(gif_path, "wb") as f:
-                f.write(uploaded_gif.read())
+            content = uploaded_gif.getvalue()
+            result_key = cache_key("codee-decode", content_hash(content), binary_key)
+
+            def decode_upload():
+                with job_workspace(session_workspace()) as work:
+                    gif_path = os.path.join(work, os.path.basename(uploaded_gif.name))
+                    with open(gif_path, "wb") as f:
+                        f.write(content)
+                    recovered = decode(gif_path, binary_key=binary_key, progress=progress_bar("Decoding"),
+                                       out_dir=os.path.join(work, "recovered"))
+                    with open(recovered, "rb") as f:
+                        return f.read(), {"name": os.path.basename(recovered)}
 
-            st.write("Decoding in progress...")
             try:
-                decode(gif_path, binary_key=binary_key)
-                st.success("Decoding completed!")
-                st.write("Recovered files:")
-
-                # Display and provide download links for recovered files
-                recovered_files = os.listdir("recovered_files")
-                if recovered_files:
-                    for recovered_file in recovered_files:
-                        file_path = os.path.join("recovered_files", recovered_file)
-                        if recovered_file.endswith(".jpg") or recovered_file.endswith(".png"):
-                            st.image(file_path, caption=recovered_file)
-                        st.download_button(
-                            f"Download {recovered_file}",
-                            data=open(file_path, "rb"),
-                            file_name=recovered_file
-                        )
-                else:
-                    st.warning("No recovered files found.")
+                data, meta = cached(result_key, decode_upload)
+                st.session_state["decoded"] = (meta["name"], data)
             except Exception as e:
                 st.error(f"Error during decoding: {e}")
         else:
             st.warning("Please upload a GIF to decode.")
 
+    if "decoded" in st.session_state:
+        recovered_file, data = st.session_state["decoded"]
+        st.success("Decoding completed!")
+        st.write("Recovered files:")
+        if recovered_file.endswith(".jpg") or recovered_file.endswith(".png"):
+            st.image(data, caption=recovered_file)
+        st.download_button(f"Download {recovered_file}", data=data, file_name=recovered_file)
+
 # Footer
 st.sidebar.header("About")
 st.sidebar.info(
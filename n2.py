@@ -1,8 +1,12 @@
 from __future__ import print_function
+import itertools
+import re
 import string
+from functools import lru_cache
+
+import numpy as np
 
 from PIL import Image
-import binascii
 import imageio.v2 as imageio  # updated for the latest imageio version
 import os
 import sys
@@ -22,59 +26,230 @@ polybius_square = {
 
 inverse_polybius_square = {v: k for k, v in polybius_square.items()}
 
+# Cipher engine. Both stages are table lookups over the whole text rather
+# than a loop over its characters: the Polybius stage deletes everything
+# but the letters and looks each one's two digits up in a table, and the
+# Vigenère stage shifts every key position's characters through that
+# position's own precomputed 256-entry table. That is for ASCII text;
+# other text goes through str.translate and arithmetic shifts instead.
+# Output is the same as the per-character versions these replaced.
+
+# Every character whose upper() is a square letter: A-Z, a-z, and the
+# dotless i and long s, which upper-case to I and S
+_POLYBIUS_LETTERS = string.ascii_letters + "ıſ"
+_POLYBIUS_TABLE = str.maketrans({char: polybius_square[char.upper()] for char in _POLYBIUS_LETTERS})
+_NOT_POLYBIUS = re.compile(f"[^{_POLYBIUS_LETTERS}]+")
+# The same for ASCII text: bytes to delete, and a table of digits
+_NOT_ASCII_LETTERS = bytes(code for code in range(256) if chr(code) not in string.ascii_letters)
+
+def _polybius_digit_table():
+    # Each ASCII letter's two digits as one little-endian 16-bit number, so
+    # a lookup copies one element
+    table = np.zeros(256, dtype="<u2")
+    for char in string.ascii_letters:
+        table[ord(char)] = int.from_bytes(polybius_square[char.upper()].encode(), "little")
+    return table
+
+_POLYBIUS_DIGITS = _polybius_digit_table()
+
+def _polybius_pair_table():
+    # Letter for every pair of ASCII characters read as one 16-bit number,
+    # 0 where the pair is not in the square. I and J share "24", which
+    # decrypts to J as inverse_polybius_square does.
+    table = np.zeros(1 << 16, dtype=np.uint8)
+    for pair, char in inverse_polybius_square.items():
+        table[ord(pair[0]) << 8 | ord(pair[1])] = ord(char)
+    return table
+
+_POLYBIUS_PAIRS = _polybius_pair_table()
+
+def _split(joined, lengths):
+    # `joined` cut back into pieces of the given lengths
+    ends = list(itertools.accumulate(lengths))
+    return [joined[start:end] for start, end in zip([0] + ends, ends)]
+
+def polybius_encrypt_texts(texts):
+    # Square coordinates of the letters of every text; everything else is
+    # dropped. The letters of all ASCII texts are looked up in one pass.
+    letters = [text.encode("ascii").translate(None, _NOT_ASCII_LETTERS) if text.isascii() else None
+               for text in texts]
+    ascii_letters = np.frombuffer(b"".join(part for part in letters if part is not None), dtype=np.uint8)
+    digits = iter(_split(np.take(_POLYBIUS_DIGITS, ascii_letters).tobytes().decode("ascii"),
+                         [2 * len(part) for part in letters if part is not None]))
+    return [_NOT_POLYBIUS.sub("", text).translate(_POLYBIUS_TABLE) if part is None else next(digits)
+            for text, part in zip(texts, letters)]
+
+def polybius_decrypt_texts(texts):
+    # Letters for the pairs of characters of every text, taken from the
+    # start of each; pairs that aren't square coordinates (and an odd last
+    # character) are dropped. Every text's pairs are looked up in one pass.
+    # Characters outside ASCII are never part of a pair and become "?".
+    data = "".join(text + "?" * (len(text) % 2) for text in texts).encode("ascii", "replace")
+    pairs = np.frombuffer(data, dtype=np.uint8).reshape(-1, 2).astype(np.uint16)
+    letters = _POLYBIUS_PAIRS[pairs[:, 0] << 8 | pairs[:, 1]].tobytes()
+    pieces = _split(letters, [(len(text) + 1) // 2 for text in texts])
+    return [piece.replace(b"\0", b"").decode("ascii") for piece in pieces]
+
+@lru_cache(maxsize=32)
+def _vigenere_tables(key, sign):
+    # One 256-entry table per key position, mapping every ASCII byte to its
+    # shifted letter, or itself if it isn't a letter; flattened so that
+    # position p's table starts at p * 256
+    shifts = np.array([ord(char) - ord('A') for char in key]) * sign
+    codes = np.arange(256)
+    alpha = np.array([chr(code) in string.ascii_letters for code in codes])
+    shifted = (codes[None, :] - ord('A') + shifts[:, None]) % 26 + ord('A')
+    tables = np.where(alpha[None, :], shifted, codes[None, :]).astype(np.uint8).ravel()
+    tables.flags.writeable = False
+    return tables
+
+def _key_positions(lengths, period):
+    # Key position of every character of texts of the given lengths, joined;
+    # each text starts at position 0
+    lengths = np.array(lengths, dtype=np.intp)
+    positions = np.arange(lengths.sum(), dtype=np.uint32)
+    if lengths.size > 1:
+        positions -= np.repeat((np.cumsum(lengths) - lengths).astype(np.uint32), lengths)
+    positions %= period
+    return positions
+
+def _vigenere_texts(texts, key, sign):
+    # vigenere_encrypt (sign 1) or vigenere_decrypt (sign -1) of every text
+    # in one pass over the joined texts. Texts without letters, such as
+    # Polybius output, come back as they are.
+    key = key.upper()
+    joined = "".join(texts)
+    if joined.isascii():
+        data = joined.encode("ascii")
+        if len(data.translate(None, string.ascii_letters.encode())) == len(data):
+            return list(texts)
+    elif not any(char.isalpha() for char in joined):
+        return list(texts)
+    if not key:
+        raise ValueError("Vigenère key must not be empty")
+    positions = _key_positions([len(text) for text in texts], len(key))
+    if joined.isascii():
+        positions <<= 8
+        positions += np.frombuffer(data, dtype=np.uint8)
+        out = _vigenere_tables(key, sign)[positions].tobytes().decode("ascii")
+    else:
+        codes = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+        alphabetic = [code for code in np.unique(codes) if chr(code).isalpha()]
+        shifts = np.array([ord(char) - ord('A') for char in key]) * sign
+        shifted = (codes - ord('A') + shifts[positions]) % 26 + ord('A')
+        out = np.where(np.isin(codes, alphabetic), shifted, codes).astype(np.uint32).tobytes().decode("utf-32-le")
+    return _split(out, [len(text) for text in texts])
+
 # Vigenère Cipher Functions
 def vigenere_encrypt(text, key):
-    encrypted = []
-    key = key.upper()
-    for i, char in enumerate(text):
-        if char.isalpha():
-            shift = ord(key[i % len(key)]) - ord('A')
-            encrypted_char = chr(((ord(char) - ord('A') + shift) % 26) + ord('A'))
-            encrypted.append(encrypted_char)
-        else:
-            encrypted.append(char)
-    return ''.join(encrypted)
+    return _vigenere_texts([text], key, 1)[0]
 
 def vigenere_decrypt(text, key):
-    decrypted = []
-    key = key.upper()
-    for i, char in enumerate(text):
-        if char.isalpha():
-            shift = ord(key[i % len(key)]) - ord('A')
-            decrypted_char = chr(((ord(char) - ord('A') - shift + 26) % 26) + ord('A'))
-            decrypted.append(decrypted_char)
-        else:
-            decrypted.append(char)
-    return ''.join(decrypted)
+    return _vigenere_texts([text], key, -1)[0]
 
 # Polybius and Vigenère Hybrid Encryption
 def hybrid_encrypt(plaintext, vigenere_key):
-    # Step 1: Apply Polybius encryption
-    polybius_encrypted = ''.join(polybius_square.get(char.upper(), '') for char in plaintext if char.upper() in polybius_square)
-    
-    # Step 2: Apply Vigenère cipher on the Polybius output
-    vigenere_encrypted = vigenere_encrypt(polybius_encrypted, vigenere_key)
-    return vigenere_encrypted
+    return hybrid_encrypt_batch([plaintext], vigenere_key)[0]
 
 def hybrid_decrypt(encrypted_text, vigenere_key):
-    # Step 1: Apply Vigenère decryption
-    vigenere_decrypted = vigenere_decrypt(encrypted_text, vigenere_key)
-    
-    # Step 2: Convert Polybius numbers back to text
-    polybius_decrypted = ''.join(inverse_polybius_square.get(vigenere_decrypted[i:i+2], '') for i in range(0, len(vigenere_decrypted), 2))
-    return polybius_decrypted
+    return hybrid_decrypt_batch([encrypted_text], vigenere_key)[0]
+
+# Batch versions for many texts under one key: the Vigenère and Polybius
+# decryption stages run once over all of them, which is what makes short
+# texts cheap. Each text is encrypted as if on its own.
+def hybrid_encrypt_batch(plaintexts, vigenere_key):
+    plaintexts = list(plaintexts)
+    # Step 1: Polybius square coordinates of the letters
+    polybius_encrypted = polybius_encrypt_texts(plaintexts)
+    # Step 2: Vigenère cipher on the Polybius output
+    return _vigenere_texts(polybius_encrypted, vigenere_key, 1)
+
+def hybrid_decrypt_batch(encrypted_texts, vigenere_key):
+    encrypted_texts = list(encrypted_texts)
+    vigenere_decrypted = _vigenere_texts(encrypted_texts, vigenere_key, -1)
+    return polybius_decrypt_texts(vigenere_decrypted)
+
+# Binary data goes through the alphabetic cipher as letters: every 4 bits
+# become one of 16 square letters (I and J, which share a cell, are left
+# out so that decryption gives the same letter back), and every pair of
+# Polybius digits in the ciphertext is stored as 5 bits. The Vigenère stage
+# of hybrid_encrypt only shifts letters, and Polybius output has none, so
+# the key is applied to the letters first, as a Vigenère cipher over the
+# 16 nibble letters (see nibble_encrypt).
+NIBBLE_LETTERS = "ABCDEFGHKLMNOPQR"
+_HEX_2_LETTERS = str.maketrans("0123456789abcdef", NIBBLE_LETTERS)
+_LETTERS_2_HEX = str.maketrans(NIBBLE_LETTERS, "0123456789abcdef")
+
+@lru_cache(maxsize=32)
+def _nibble_tables(key, sign):
+    # _vigenere_tables for the nibble letters: every byte of the key gives
+    # two shifts, its high and its low 4 bits, so different keys shift
+    # differently (case aside, as in vigenere_encrypt). Other bytes map to
+    # themselves.
+    shifts = np.array([shift for byte in key.upper().encode() for shift in divmod(byte, 16)]) * sign
+    codes = np.arange(256)
+    letters = np.frombuffer(NIBBLE_LETTERS.encode("ascii"), dtype=np.uint8)
+    tables = np.tile(codes, (len(shifts), 1))
+    tables[:, letters] = letters[(np.arange(16)[None, :] + shifts[:, None]) % 16]
+    tables = tables.astype(np.uint8).ravel()
+    tables.flags.writeable = False
+    return tables
+
+def _nibble_vigenere(text, key, sign):
+    if not key:
+        raise ValueError("Vigenère key must not be empty")
+    if not text:
+        return text
+    tables = _nibble_tables(key, sign)
+    positions = _key_positions([len(text)], tables.size >> 8)
+    positions <<= 8
+    positions += np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    return tables[positions].tobytes().decode("ascii")
+
+def nibble_encrypt(text, key):
+    return _nibble_vigenere(text, key, 1)
+
+def nibble_decrypt(text, key):
+    return _nibble_vigenere(text, key, -1)
+
+def bits_2_letters(bitstr):
+    # A "0"/"1" string as letters, zero-padded to a multiple of 4 bits
+    bitstr += "0" * (-len(bitstr) % 4)
+    if not bitstr:
+        return ""
+    return format(int(bitstr, 2), f"0{len(bitstr) // 4}x").translate(_HEX_2_LETTERS)
+
+def letters_2_bits(text):
+    if not text:
+        return ""
+    return format(int(text.translate(_LETTERS_2_HEX), 16), f"0{len(text) * 4}b")
+
+def cipher_2_bits(text):
+    # Polybius digit pairs ("11" to "55") as 5-bit numbers 0-24
+    digits = np.frombuffer(text.encode("ascii"), dtype=np.uint8).reshape(-1, 2) - ord('1')
+    values = (digits[:, 0] * 5 + digits[:, 1]).astype(np.uint8)
+    bits = np.unpackbits(values[:, None], axis=1)[:, 3:]
+    return (bits.ravel() + ord('0')).tobytes().decode("ascii")
+
+def bits_2_cipher(bitstr):
+    # Inverse of cipher_2_bits; a final partial group of bits is dropped
+    nbits = len(bitstr) - len(bitstr) % 5
+    bits = np.frombuffer(bitstr[:nbits].encode("ascii"), dtype=np.uint8).reshape(-1, 5) - ord('0')
+    values = bits @ np.array([16, 8, 4, 2, 1], dtype=np.uint8)
+    digits = np.stack([values // 5, values % 5], axis=1) + ord('1')
+    return digits.astype(np.uint8).tobytes().decode("ascii")
 
 # Modify the encode/decode functions to use the hybrid encryption/decryption
 def encode(src,  vigenere_key="SECRET"):
     bits = file_2_bits(src)
     bits = add_header(bits, os.path.basename(src))
     
-    # Encrypt bits using hybrid encryption (convert to string first)
+    # Encrypt bits using hybrid encryption (as letters, see bits_2_letters)
     bit_string = ''.join(bits)
-    encrypted_text = hybrid_encrypt(bit_string, vigenere_key)
+    encrypted_text = hybrid_encrypt(nibble_encrypt(bits_2_letters(bit_string), vigenere_key), vigenere_key)
     
     # Convert encrypted text back to bits and then to pixels
-    encrypted_bits = list(encrypted_text)  # Convert encrypted text back to bits
+    encrypted_bits = list(cipher_2_bits(encrypted_text))
     pixels = bits_2_pixels(encrypted_bits)
     pixels_per_image = res[0] * res[1]
     num_imgs = (len(pixels) + pixels_per_image - 1) // pixels_per_image
@@ -88,7 +263,7 @@ def encode(src,  vigenere_key="SECRET"):
     
     return make_gif("temp", os.path.basename(src))
 
-def decode(src, vigenere_key="SECRET"):
+def decode(src, vigenere_key="SECRET", out_dir="recovered_files"):
     # Decode steps (from your existing code)
     def iter_frames(im):
         try:
@@ -106,27 +281,31 @@ def decode(src, vigenere_key="SECRET"):
             pixels.extend(list(frame.getdata()))
     
     bits = pixels_2_bits(pixels)
-    fname, bits = decode_header(bits)
     
-    # Decrypt bits using hybrid decryption (convert to string first)
+    # Decrypt bits using hybrid decryption (convert to string first); the
+    # header is encrypted with the payload
     bit_string = ''.join(bits)
-    decrypted_text = hybrid_decrypt(bit_string, vigenere_key)
+    decrypted_text = nibble_decrypt(hybrid_decrypt(bits_2_cipher(bit_string), vigenere_key), vigenere_key)
     
-    # Convert decrypted text back to original bits
-    original_bits = list(decrypted_text)
-    recovered_fname = f"recovered_files/{fname}-recovered.bin"
+    # Convert decrypted text back to original bits; frame padding past the
+    # payload is cut off with the header's payload length
+    fname, original_bits = decode_header(list(letters_2_bits(decrypted_text)))
+    recovered_fname = os.path.join(out_dir, f"{fname}-recovered.bin")
     
-    os.makedirs("recovered_files", exist_ok=True)
+    os.makedirs(out_dir, exist_ok=True)
     bits_2_file(original_bits, recovered_fname)
+    return recovered_fname
 
 
 def make_gif(parent_folder, fname):
     items = os.listdir(parent_folder)
     png_filenames = [elem for elem in items if elem.endswith(".png")]
 
+    # Frames are named <file name>-<number>.png, and the file name may hold
+    # dashes of its own
     sorted_png = sorted(
         png_filenames,
-        key=lambda p: int(p.split("-")[1].split(".")[0])
+        key=lambda p: int(p.rsplit("-", 1)[1].split(".")[0])
     )
 
     with imageio.get_writer(f"{fname}.gif", mode="I", duration=0.1) as writer:
@@ -173,15 +352,14 @@ def pixels_2_bits(pixels):
     return bits
 
 def add_header(bits, fname):
-    fname_bitstr = bin(int(binascii.hexlify(fname.encode()), 16))[2:]
+    # Whole bytes, as decode_header reads them
+    fname_bitstr = ''.join(format(byte, '08b') for byte in fname.encode())
     fname_bitstr_length_bitstr = bin(len(fname_bitstr))[2:].zfill(16)
     payload_length_header = bin(len(bits))[2:].zfill(64)
     header_list = list(fname_bitstr_length_bitstr + fname_bitstr + payload_length_header)
     return header_list + bits
 
 
-import re
-
 def decode_header(bits):
     def decode_binary_string(s):
         try:
@@ -192,6 +370,9 @@ def decode_header(bits):
     fname_length = int(''.join(bits[:16]), 2)
     fname_bits = ''.join(bits[16:16 + fname_length])
     payload_length = int(''.join(bits[16 + fname_length:16 + fname_length + 64]), 2)
+    # Lengths that don't fit the data are what a wrong key decrypts to
+    if fname_length % 8 or 16 + fname_length + 64 + payload_length > len(bits):
+        raise ValueError("Header does not fit the data: wrong key, or not an n2 GIF")
 
     # Decode the file name and handle decoding errors
     fname = decode_binary_string(fname_bits)
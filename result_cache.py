@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import tempfile
+
+# Disk cache for encode/decode results, shared by every session and process
+# of the Streamlit apps. Entries are keyed by a hash of the input content and
+# the options that produced them; the least recently used entries are
+# evicted once the cache is over CACHE_MAX_BYTES. Cached results are
+# decrypted files, so the cache is per user (under XDG_CACHE_HOME, or
+# ~/.cache) and its directory is made readable by its owner only.
+def default_cache_dir(environ=os.environ):
+    if environ.get("HYBRIDCRYPT_CACHE_DIR"):
+        return environ["HYBRIDCRYPT_CACHE_DIR"]
+    base = environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "hybridcrypt")
+
+CACHE_DIR = default_cache_dir()
+CACHE_MAX_BYTES = int(os.environ.get("HYBRIDCRYPT_CACHE_MB", "512")) << 20
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def cache_key(*parts):
+    # Key for a result made from `parts`: content hashes, keys, options.
+    # The encryption key is only ever stored hashed into this.
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+def cache_get(key, cache_dir=CACHE_DIR):
+    # Returns (data, meta) or None
+    path = os.path.join(cache_dir, key)
+    try:
+        with open(path + ".json") as f:
+            meta = json.load(f)
+        with open(path + ".bin", "rb") as f:
+            data = f.read()
+    except (OSError, ValueError):
+        return None
+    # Mark as recently used. The entry may have been evicted since it was
+    # read; the data is still good, so that is a hit all the same.
+    try:
+        os.utime(path + ".bin")
+    except OSError:
+        pass
+    return data, meta
+
+def cache_put(key, data, meta=None, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    # Store a result, then evict old entries. Results bigger than the whole
+    # cache are not stored.
+    if len(data) > max_bytes:
+        return
+    make_cache_dir(cache_dir)
+    path = os.path.join(cache_dir, key)
+    # Write then rename, so other processes never see a partial entry; the
+    # metadata goes last since cache_get reads it first
+    for suffix, content in ((".bin", data), (".json", json.dumps(meta or {}).encode())):
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path + suffix)
+    evict(cache_dir, max_bytes)
+
+def make_cache_dir(cache_dir):
+    # makedirs' mode is cut by the umask, and an existing directory keeps
+    # its own, so the mode is set explicitly
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    os.chmod(cache_dir, 0o700)
+
+def evict(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    # Remove least recently used entries until the cache fits in max_bytes
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".bin"):
+            try:
+                st = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name[:-4]))
+    total = sum(size for _, size, _ in entries)
+    for _, size, key in sorted(entries):
+        if total <= max_bytes:
+            break
+        for suffix in (".json", ".bin"):
+            try:
+                os.remove(os.path.join(cache_dir, key + suffix))
+            except FileNotFoundError:
+                pass
+        total -= size
+
+def cached(key, produce, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    # cache_get(key), or else produce() -> (data, meta), stored and returned
+    hit = cache_get(key, cache_dir)
+    if hit is not None:
+        return hit
+    data, meta = produce()
+    cache_put(key, data, meta, cache_dir, max_bytes)
+    return data, meta
@@ -0,0 +1,344 @@
+import argparse
+import contextlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import codee
+from hybridcrypt import ascii_key_to_binary, parse_res
+
+# Local HTTP front end for codee, for calling the codec from other services:
+#   python server.py --port 8080
+#   curl -T notes.txt -H "X-Key: key" "localhost:8080/encode?name=notes.txt" -o notes.gif
+#   curl -T notes.gif -H "X-Key: key" localhost:8080/decode -OJ
+#   curl -T notes.txt -H "X-Key: key" "localhost:8080/encode?name=notes.txt&container=png&density=24" -o notes.png
+#   curl localhost:8080/health
+#
+# POST (or PUT) /encode takes the file as the request body and answers with the image;
+# query options are name, container (gif, apng, png or webp; default gif), res
+# (auto, 4k, hd or WIDTHxHEIGHT), density, compression (none, auto or one of
+# codee.COMPRESSIONS), cipher (one of codee.CIPHERS) and integrity (0 or 1).
+# POST /decode takes an image in any container and answers with the recovered file, named in
+# Content-Disposition. The key is the ASCII X-Key header.
+#
+# Uploads, plain or chunked, are streamed to a file in the request's job
+# workspace rather than held in memory; the codec needs the whole input
+# before it starts (its header holds the size and digest, and a GIF is
+# scanned as a whole). Responses are sent with chunked transfer encoding
+# as they are produced: every frame as soon as it is compressed, and
+# the recovered file a chunk at a time. An error after the response has
+# started (a digest mismatch found at the end of a decode) can't change
+# the status any more, so the connection is dropped without the final
+# chunk and the client sees a truncated body.
+#
+# Connections are kept alive between requests. At most MAX_REQUESTS
+# encodes and decodes run at once; others wait up to QUEUE_TIMEOUT seconds
+# for a slot and are then answered 503. The upload is spooled to the
+# workspace before a slot is taken, so a slow client holds a connection
+# but not a worker. GET /health (or /metrics) reports
+# the load, counters and recent latencies as JSON.
+MAX_REQUESTS = int(os.environ.get("HYBRIDCRYPT_SERVER_JOBS", os.cpu_count() or 1))
+QUEUE_TIMEOUT = float(os.environ.get("HYBRIDCRYPT_SERVER_QUEUE_TIMEOUT", "30"))
+READ_CHUNK = 1 << 20
+# Latencies kept for the percentiles in /health
+LATENCY_WINDOW = 1000
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ChunkedWriter:
+    # Writable file object sending everything written to it as HTTP/1.1
+    # chunks; finish() sends the terminating chunk
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.nbytes = 0
+
+    def write(self, data):
+        if data:
+            self.wfile.write(b"%x\r\n" % len(data))
+            self.wfile.write(data)
+            self.wfile.write(b"\r\n")
+            self.nbytes += len(data)
+        return len(data)
+
+    def finish(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+def clean_name(text):
+    # An upload name that is safe as a file name in the workspace and in a
+    # Content-Disposition header, cleaned as codee cleans recovered names
+    name = re.sub(r'[^A-Za-z0-9_.]', '_', os.path.basename(text))
+    if not name.strip("."):
+        raise HTTPError(400, f"bad file name: {text!r}")
+    return name
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+# Load and counters for /health, shared by all request threads
+_lock = threading.Lock()
+_slots = None
+_metrics = {}
+_latencies = {}
+
+def _reset_metrics(limit):
+    global _slots
+    _slots = threading.BoundedSemaphore(limit)
+    _metrics.clear()
+    _metrics.update(limit=limit, started=time.time(), in_flight=0, waiting=0, rejected=0, requests={}, statuses={},
+                    bytes_in=0, bytes_out=0)
+    _latencies.clear()
+
+def _record(route, status, seconds, bytes_in, bytes_out):
+    with _lock:
+        _metrics["requests"][route] = _metrics["requests"].get(route, 0) + 1
+        _metrics["statuses"][str(status)] = _metrics["statuses"].get(str(status), 0) + 1
+        _metrics["bytes_in"] += bytes_in
+        _metrics["bytes_out"] += bytes_out
+        _latencies.setdefault(route, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+def health():
+    with _lock:
+        report = {name: value for name, value in _metrics.items() if name != "started"}
+        report.update(status="ok", uptime=time.time() - _metrics["started"],
+                      requests=dict(_metrics["requests"]), statuses=dict(_metrics["statuses"]))
+        report["latency_ms"] = {route: {"p50": percentile(values, 0.5) * 1e3, "p99": percentile(values, 0.99) * 1e3,
+                                        "count": len(values)}
+                                for route, values in _latencies.items()}
+    return report
+
+def _acquire_slot():
+    with _lock:
+        _metrics["waiting"] += 1
+    acquired = _slots.acquire(timeout=QUEUE_TIMEOUT)
+    with _lock:
+        _metrics["waiting"] -= 1
+        if acquired:
+            _metrics["in_flight"] += 1
+        else:
+            _metrics["rejected"] += 1
+    return acquired
+
+def _release_slot():
+    with _lock:
+        _metrics["in_flight"] -= 1
+    _slots.release()
+
+@contextlib.contextmanager
+def codec_slot():
+    # Held around the codec call only, not around reading the upload
+    if not _acquire_slot():
+        raise HTTPError(503, f"all {_metrics['limit']} workers busy")
+    try:
+        yield
+    finally:
+        _release_slot()
+
+class CodecHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "hybridcrypt"
+    # Set by serve()
+    workspace = None
+
+    def do_GET(self):
+        route = urlsplit(self.path).path
+        if route not in ("/health", "/metrics"):
+            return self.send_json(404, {"error": f"no such endpoint: {route}"})
+        self.send_json(200, health())
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        handlers = {"/encode": self.handle_encode, "/decode": self.handle_decode}
+        if url.path not in handlers:
+            self.discard_body()
+            return self.send_json(404, {"error": f"no such endpoint: {url.path}"})
+        options = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        start = time.perf_counter()
+        status, bytes_out = 500, 0
+        try:
+            key = self.headers.get("X-Key")
+            if not key:
+                raise HTTPError(400, "missing X-Key header")
+            with codee.job_workspace(self.workspace) as work:
+                status, bytes_out = handlers[url.path](ascii_key_to_binary(key), options, work)
+        except Exception as e:
+            if isinstance(e, HTTPError):
+                status = e.status
+            elif isinstance(e, (ValueError, argparse.ArgumentTypeError)):
+                status = 400
+            if self.headers_sent:
+                # Too late for an error status: cut the body short
+                status = 500
+                self.close_connection = True
+                self.log_error("failed mid-response: %s", e)
+            else:
+                self.discard_body()
+                self.send_json(status, {"error": str(e)})
+        finally:
+            _record(url.path, status, time.perf_counter() - start, self.bytes_in, bytes_out)
+
+    # curl -T uploads with PUT
+    do_PUT = do_POST
+
+    def handle_encode(self, key, options, work):
+        name = clean_name(options.get("name") or "upload.bin")
+        res = parse_res(options.get("res", codee.AUTO_RES))
+        container = options.get("container", "gif")
+        density = int(options.get("density", 1))
+        compression = options.get("compression", "none")
+        integrity = options.get("integrity", "1") not in ("0", "false", "no")
+        cipher = options.get("cipher", codee.DEFAULT_CIPHER)
+        # Checked before the upload is read, so bad options are a 400
+        container = codee.check_container(container, density)
+        codee.check_compression(compression)
+        codee.check_cipher(cipher)
+        codee.check_frame_size(res, density, container.name, compression, integrity, cipher)
+        src = os.path.join(work, name)
+        self.read_body(src)
+        with codec_slot():
+            self.start_response(container.mime, name + container.suffix)
+            out = ChunkedWriter(self.wfile)
+            codee.encode_stream(src, key, res, target=out, density=density, compression=compression,
+                                integrity=integrity, workdir=work, container=container.name, cipher=cipher)
+            out.finish()
+        return 200, out.nbytes
+
+    def handle_decode(self, key, options, work):
+        # The container is told by its magic bytes, not a name
+        src = os.path.join(work, "upload")
+        self.read_body(src)
+        with codec_slot():
+            try:
+                fname, payload = codee.open_payload(src, key)
+            except (ValueError, IndexError, OSError) as e:
+                raise HTTPError(400, f"can't decode upload: {e}")
+            self.start_response("application/octet-stream", fname)
+            out = ChunkedWriter(self.wfile)
+            for piece in codee.align_bits(payload):
+                out.write(piece.data[:piece.nbits // 8].tobytes())
+            out.finish()
+        return 200, out.nbytes
+
+    def iter_body(self):
+        # The request body in pieces of at most READ_CHUNK bytes, from a
+        # Content-Length or a chunked upload; each piece is read only once
+        # the previous one has been consumed
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    # Trailers up to the blank line
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                while size:
+                    data = self.rfile.read(min(size, READ_CHUNK))
+                    if not data:
+                        raise HTTPError(400, "upload ended early")
+                    size -= len(data)
+                    self.bytes_in += len(data)
+                    yield data
+                self.rfile.readline()
+        else:
+            left = int(self.headers.get("Content-Length", 0))
+            while left:
+                data = self.rfile.read(min(left, READ_CHUNK))
+                if not data:
+                    raise HTTPError(400, "upload ended early")
+                left -= len(data)
+                self.bytes_in += len(data)
+                yield data
+
+    def read_body(self, path):
+        with open(path, "wb") as f:
+            for data in self.iter_body():
+                f.write(data)
+        self.body_read = True
+
+    def discard_body(self):
+        # A small unread body is read and dropped, so the connection can be
+        # kept alive; a rejected big or chunked upload closes it instead
+        if self.body_read:
+            return
+        if self.headers.get("Transfer-Encoding") or int(self.headers.get("Content-Length") or 0) > READ_CHUNK:
+            self.close_connection = True
+            return
+        try:
+            for _ in self.iter_body():
+                pass
+            self.body_read = True
+        except (ValueError, HTTPError):
+            self.close_connection = True
+
+    def start_response(self, content_type, filename):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.headers_sent = True
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def handle_one_request(self):
+        # Per-request state on a kept-alive connection
+        self.headers_sent = False
+        self.body_read = False
+        self.bytes_in = 0
+        super().handle_one_request()
+
+def serve(host="127.0.0.1", port=8080, limit=MAX_REQUESTS, workspace=None):
+    # Runs until interrupted. Job workspaces are made under `workspace`,
+    # by default a temporary directory removed on exit.
+    owned = workspace is None
+    if owned:
+        workspace = tempfile.mkdtemp(prefix="hybridcrypt-server-")
+    _reset_metrics(limit)
+    CodecHandler.workspace = workspace
+    server = ThreadingHTTPServer((host, port), CodecHandler)
+    server.daemon_threads = True
+    print(f"hybridcrypt server on http://{host}:{server.server_port} ({limit} concurrent jobs)", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if owned:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="hybridcrypt-server", description="Serve codee encode and decode over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("-j", "--jobs", type=int, default=MAX_REQUESTS,
+                        help="encodes and decodes run at once (default: HYBRIDCRYPT_SERVER_JOBS or one per CPU)")
+    parser.add_argument("--workspace", help="directory for uploads and scratch files (default: a temporary one)")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, max(1, args.jobs), args.workspace)
+
+if __name__ == "__main__":
+    main()
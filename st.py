@@ -2,17 +2,58 @@ import streamlit as st
 import os
 from PIL import Image
 import shutil
-from main import encode, decode, convert_all_bin_to_jpg
+import tempfile
+import time
+import jobs
+from codee import CONTAINERS
+from result_cache import cache_get, cache_key, cache_put, content_hash
 
 def text_to_binary(input_text):
     binary_output = ''.join(format(ord(char), '08b') for char in input_text)
     return binary_output
 
-# Helper function to clear temporary folders
-def clear_temp_folders():
-    for folder in ["temp", "recovered_files", "recovered"]:
-        shutil.rmtree(folder, ignore_errors=True)
-        os.makedirs(folder, exist_ok=True)
+# Private scratch directory for this browser session; every job works in
+# its own directory inside it, which is removed when the job is done
+def session_workspace():
+    if "workspace" not in st.session_state:
+        st.session_state["workspace"] = tempfile.TemporaryDirectory(prefix="hybridcrypt-session-")
+    return st.session_state["workspace"].name
+
+# Encode and decode run in the background job queue, so the page stays
+# responsive. The session keeps the job's id, directory `work` and result
+# cache key under `name` until it finishes; the page polls while any job is
+# running. Results are cached as main.py caches them, with the same keys,
+# and a cached result skips the queue.
+JOB_NAMES = ("encode_job", "decode_job")
+
+def start_job(name, work, result_key, kind, *args, **kwargs):
+    st.session_state[name] = (jobs.submit(kind, *args, **kwargs), work, result_key)
+
+# Shows the job's progress and a cancel button. Returns (result path,
+# directory, result cache key) once it is done, the directory then being
+# the caller's to remove; None while it runs or after it failed or was
+# cancelled.
+def follow_job(name, label):
+    if name not in st.session_state:
+        return None
+    job_id, work, result_key = st.session_state[name]
+    status = jobs.status(job_id)
+    if status.state in ("queued", "running"):
+        text = "Waiting for a free worker..." if status.state == "queued" else f"{label} {status.fraction:.0%}"
+        st.progress(status.fraction, text=text)
+        if st.button("Cancel", key=f"{name}_cancel"):
+            jobs.cancel(job_id)
+        return None
+    jobs.forget(job_id)
+    del st.session_state[name]
+    if status.state == "done":
+        return status.result, work, result_key
+    if status.state == "failed":
+        st.error(f"Error during {label.lower()}: {status.error}")
+    else:
+        st.warning(f"{label} cancelled.")
+    shutil.rmtree(work, ignore_errors=True)
+    return None
 
 # Set up the Streamlit app
 st.set_page_config(page_title="File to GIF Encoder/Decoder", layout="centered")
@@ -28,71 +69,109 @@ with tab1:
 
     resolution = st.selectbox(
         "Select GIF Resolution",
-        options=["4K (3840x2160)", "HD (1920x1080)"],
-        index=1
+        options=["Auto (fit to file)", "4K (3840x2160)", "HD (1920x1080)"],
+        index=0
     )
 
     res_map = {
+        "Auto (fit to file)": "auto",
         "4K (3840x2160)": (3840, 2160),
         "HD (1920x1080)": (1920, 1080)
     }
     res = res_map[resolution]
+    container = st.selectbox(
+        "Image format",
+        options=list(CONTAINERS),
+        index=0,
+        help="GIF opens anywhere; PNG, APNG and WebP are smaller and faster to encode and decode."
+    )
+    encode_key = st.text_input("Key (ASCII):", value="key", key="encode_key")
 
-    if st.button("Encode"):
+    if st.button("Encode", disabled="encode_job" in st.session_state):
         if uploaded_file is not None:
-            clear_temp_folders()
-            input_file_path = os.path.join("temp", uploaded_file.name)
-            with open(input_file_path, "wb") as f:
-                f.write(uploaded_file.read())
-            
-            st.write("Encoding in progress...")
-            try:
-                gif_path = encode(input_file_path, res=res)
-                st.success("Encoding completed!")
-                st.image(gif_path, caption="Encoded GIF")
-                st.download_button("Download Encoded GIF", data=open(gif_path, "rb"), file_name=os.path.basename(gif_path))
-            except Exception as e:
-                st.error(f"Error during encoding: {e}")
+            content = uploaded_file.getvalue()
+            binary_key = text_to_binary(encode_key)
+            name = os.path.basename(uploaded_file.name)
+            # Density 1 and no compression, as encode defaults to
+            result_key = cache_key("codee-encode", content_hash(content), uploaded_file.name,
+                                   binary_key, res, 1, "none", container)
+            hit = cache_get(result_key)
+            if hit is not None:
+                # Kept in the session so reruns (e.g. clicking download) show it again
+                st.session_state["encoded"] = (name + CONTAINERS[container].suffix, hit[0])
+            else:
+                work = tempfile.mkdtemp(dir=session_workspace())
+                input_file_path = os.path.join(work, name)
+                with open(input_file_path, "wb") as f:
+                    f.write(content)
+                start_job("encode_job", work, result_key, "encode", input_file_path, binary_key, res,
+                          target=input_file_path + CONTAINERS[container].suffix, container=container)
         else:
             st.warning("Please upload a file to encode.")
 
+    finished = follow_job("encode_job", "Encoding")
+    if finished is not None:
+        gif_path, work, result_key = finished
+        with open(gif_path, "rb") as f:
+            gif_bytes = f.read()
+        cache_put(result_key, gif_bytes)
+        st.session_state["encoded"] = (os.path.basename(gif_path), gif_bytes)
+        shutil.rmtree(work, ignore_errors=True)
+
+    if "encoded" in st.session_state:
+        name, gif_bytes = st.session_state["encoded"]
+        st.success("Encoding completed!")
+        st.image(gif_bytes, caption="Encoded image")
+        st.download_button("Download Encoded Image", data=gif_bytes, file_name=name)
+
 # Decode Tab
 with tab2:
     st.header("Decode a GIF into its Original File")
-    uploaded_gif = st.file_uploader("Upload a GIF to decode", type=["gif"])
+    uploaded_gif = st.file_uploader("Upload a GIF to decode", type=[name for name in CONTAINERS])
+    decode_key = st.text_input("Key (ASCII):", value="key", key="decode_key")
 
-    if st.button("Decode"):
+    if st.button("Decode", disabled="decode_job" in st.session_state):
         if uploaded_gif is not None:
-            clear_temp_folders()
-            gif_path = os.path.join("temp", uploaded_gif.name)
-            with open(gif_path, "wb") as f:
-                f.write(uploaded_gif.read())
-
-            st.write("Decoding in progress...")
-            try:
-                decode(gif_path)
-                st.success("Decoding completed!")
-                st.write("Recovered files:")
-
-                # Display and provide download links for recovered files
-                recovered_files = os.listdir("recovered_files")
-                if recovered_files:
-                    for recovered_file in recovered_files:
-                        file_path = os.path.join("recovered_files", recovered_file)
-                        if recovered_file.endswith(".jpg") or recovered_file.endswith(".png"):
-                            st.image(file_path, caption=recovered_file)
-                        st.download_button(
-                            f"Download {recovered_file}",
-                            data=open(file_path, "rb"),
-                            file_name=recovered_file
-                        )
-                else:
-                    st.warning("No recovered files found.")
-            except Exception as e:
-                st.error(f"Error during decoding: {e}")
+            content = uploaded_gif.getvalue()
+            binary_key = text_to_binary(decode_key)
+            result_key = cache_key("codee-decode", content_hash(content), binary_key)
+            hit = cache_get(result_key)
+            if hit is not None:
+                data, meta = hit
+                st.session_state["decoded"] = (meta["name"], data)
+            else:
+                work = tempfile.mkdtemp(dir=session_workspace())
+                gif_path = os.path.join(work, os.path.basename(uploaded_gif.name))
+                with open(gif_path, "wb") as f:
+                    f.write(content)
+                start_job("decode_job", work, result_key, "decode", gif_path, binary_key,
+                          out_dir=os.path.join(work, "recovered"))
         else:
             st.warning("Please upload a GIF to decode.")
 
+    finished = follow_job("decode_job", "Decoding")
+    if finished is not None:
+        recovered, work, result_key = finished
+        with open(recovered, "rb") as f:
+            data = f.read()
+        cache_put(result_key, data, {"name": os.path.basename(recovered)})
+        st.session_state["decoded"] = (os.path.basename(recovered), data)
+        shutil.rmtree(work, ignore_errors=True)
+
+    if "decoded" in st.session_state:
+        recovered_file, data = st.session_state["decoded"]
+        st.success("Decoding completed!")
+        st.write("Recovered files:")
+
+        # Display and provide a download link for the recovered file
+        if recovered_file.endswith(".jpg") or recovered_file.endswith(".png"):
+            st.image(data, caption=recovered_file)
+        st.download_button(
+            f"Download {recovered_file}",
+            data=data,
+            file_name=recovered_file
+        )
+
 # Footer
 st.sidebar.header("About")
 st.sidebar.info(
@@ -101,3 +180,8 @@ st.sidebar.info(
     using advanced cryptographic and image processing techniques.
     """
 )
+
+# Poll running jobs
+if any(name in st.session_state for name in JOB_NAMES):
+    time.sleep(0.5)
+    st.rerun()
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import hybridcrypt
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_parse_res():
+    assert hybridcrypt.parse_res("hd") == hybridcrypt.codee.HD
+    assert hybridcrypt.parse_res("64x48") == (64, 48)
+    for text in ("64", "0x48", "wide"):
+        with pytest.raises(Exception):
+            hybridcrypt.parse_res(text)
+
+def test_expand_inputs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write("data/a.bin", b"a")
+    write("data/sub/b.gif", b"b")
+    write("c.gif", b"c")
+    files = hybridcrypt.expand_inputs(["data", "*.gif", "c.gif"])
+    assert files == [(os.path.abspath("data/a.bin"), "a.bin"),
+                     (os.path.abspath("data/sub/b.gif"), os.path.join("sub", "b.gif")),
+                     (os.path.abspath("c.gif"), "c.gif")]
+    assert hybridcrypt.expand_inputs(["data"], suffix=".gif") == [(os.path.abspath("data/sub/b.gif"),
+                                                                   os.path.join("sub", "b.gif"))]
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_batch_roundtrip(tmp_path, monkeypatch, jobs):
+    monkeypatch.chdir(tmp_path)
+    payloads = {"one.bin": os.urandom(3001), "two.txt": b"hybridcrypt " * 500}
+    for name, data in payloads.items():
+        write(os.path.join("data", name), data)
+    assert hybridcrypt.main(["encode", "-k", "key", "-o", "enc", "-r", "64x48", "-j", jobs, "data"]) == 0
+    assert sorted(os.listdir("enc")) == ["one.bin.gif", "two.txt.gif"]
+    assert hybridcrypt.main(["decode", "-k", "key", "-o", "rec", "-j", jobs, "enc"]) == 0
+    recovered_names = {"one.bin": "one-recovered.bin", "two.txt": "two-recovered.txt"}
+    assert sorted(os.listdir("rec")) == sorted(recovered_names.values())
+    for name, data in payloads.items():
+        assert read(os.path.join("rec", recovered_names[name])) == data
+
+def test_same_names(tmp_path, monkeypatch, capsys):
+    # Files of the same name in different directories keep their paths;
+    # a second file that would take the same output fails
+    monkeypatch.chdir(tmp_path)
+    write("in/a/x.bin", b"first" * 100)
+    write("in/b/x.bin", b"second" * 100)
+    assert hybridcrypt.main(["encode", "-k", "key", "-o", "enc", "-r", "64x48", "-j", "1", "in"]) == 0
+    assert sorted(os.listdir("enc")) == ["a", "b"]
+    assert hybridcrypt.main(["decode", "-k", "key", "-o", "rec", "-j", "1", "enc"]) == 0
+    assert read("rec/a/x-recovered.bin") == b"first" * 100
+    assert read("rec/b/x-recovered.bin") == b"second" * 100
+
+    assert hybridcrypt.main(["encode", "-k", "key", "-o", "flat", "-j", "1", "in/a/x.bin", "in/b/x.bin"]) == 1
+    assert os.listdir("flat") == ["x.bin.gif"]
+    assert "FAILED" in capsys.readouterr().err
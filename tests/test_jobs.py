@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import jobs
+
+KEY = "".join(format(ord(char), "08b") for char in "key")
+
+def test_encode_decode_jobs(tmp_path):
+    src = str(tmp_path / "payload.bin")
+    data = os.urandom(20000)
+    with open(src, "wb") as f:
+        f.write(data)
+    job = jobs.submit("encode", src, KEY, (64, 48), target=str(tmp_path / "out.gif"))
+    status = jobs.wait(job, 60)
+    assert status.state == "done" and status.fraction == 1.0
+    job = jobs.submit("decode", status.result, KEY, out_dir=str(tmp_path / "recovered"))
+    status = jobs.wait(job, 60)
+    assert status.state == "done"
+    with open(status.result, "rb") as f:
+        assert f.read() == data
+    jobs.forget(job)
+    with pytest.raises(KeyError):
+        jobs.status(job)
+
+def test_failed_and_cancelled(tmp_path):
+    status = jobs.wait(jobs.submit("decode", str(tmp_path / "missing.gif"), KEY), 60)
+    assert status.state == "failed" and isinstance(status.error, FileNotFoundError)
+
+    src = str(tmp_path / "big.bin")
+    with open(src, "wb") as f:
+        f.write(os.urandom(1 << 20))
+    job = jobs.submit("encode", src, KEY, (64, 48), target=str(tmp_path / "big.gif"))
+    jobs.cancel(job)
+    assert jobs.wait(job, 60).state == "cancelled"
+
+def test_bad_kind():
+    with pytest.raises(ValueError):
+        jobs.submit("resize")
@@ -0,0 +1,74 @@
+import os
+import random
+import string
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import n2
+
+KEY = "SECRET"
+
+def test_polybius_roundtrip():
+    # The 5x5 square shares one cell between I and J, and decrypts to
+    # capitals
+    letters = "".join(c for c in string.ascii_letters if c not in "iIjJ")
+    texts = ["", "A", "HelloWorld", "".join(random.Random(0).choices(letters, k=5000))]
+    encrypted = n2.polybius_encrypt_texts(texts)
+    assert all(set(text) <= set(string.digits) for text in encrypted)
+    assert n2.polybius_decrypt_texts(encrypted) == [text.upper() for text in texts]
+
+def test_hybrid_batch():
+    # The batch calls give what one call per text gives
+    rng = random.Random(0)
+    texts = ["", "A", "Hello, World!", "ÄB2411é5", "".join(rng.choices(string.ascii_letters + " .,", k=5000))]
+    for key in (KEY, "key", "Zz"):
+        encrypted = n2.hybrid_encrypt_batch(texts, key)
+        assert encrypted == [n2.hybrid_encrypt(text, key) for text in texts]
+        assert n2.hybrid_decrypt_batch(encrypted, key) == [n2.hybrid_decrypt(text, key) for text in encrypted]
+
+def test_vigenere():
+    assert n2.vigenere_encrypt("ATTACKATDAWN", "LEMON") == "LXFOPVEFRNHR"
+    assert n2.vigenere_decrypt("LXFOPVEFRNHR", "LEMON") == "ATTACKATDAWN"
+
+def test_binary_letters():
+    rng = random.Random(1)
+    for nbits in (0, 1, 4, 13, 8000):
+        bits = "".join(rng.choices("01", k=nbits))
+        letters = n2.bits_2_letters(bits)
+        assert set(letters) <= set(n2.NIBBLE_LETTERS)
+        back = n2.letters_2_bits(letters)
+        assert back[:nbits] == bits and set(back[nbits:]) <= {"0"}
+        cipher = n2.hybrid_encrypt(letters, KEY)
+        assert n2.bits_2_cipher(n2.cipher_2_bits(cipher)) == cipher
+
+def test_nibble_key():
+    # The binary path depends on every key byte
+    letters = n2.bits_2_letters("".join(random.Random(2).choices("01", k=4000)))
+    encrypted = n2.nibble_encrypt(letters, KEY)
+    assert set(encrypted) <= set(n2.NIBBLE_LETTERS) and encrypted != letters
+    assert n2.nibble_decrypt(encrypted, KEY) == letters
+    for key in ("XYZ", "SECRES", "A"):
+        assert n2.nibble_decrypt(encrypted, key) != letters
+
+def test_decode_header_rejects_garbage():
+    payload = list("0110" * 10)
+    fname, back = n2.decode_header(n2.add_header(payload, "a.txt"))
+    assert (fname, back) == ("a.txt", payload)
+    # A name of one byte and a payload length past the end of the data
+    bits = list(format(8, "016b") + "01000001" + "1" * 64 + "0110" * 10)
+    with pytest.raises(ValueError, match="wrong key"):
+        n2.decode_header(bits)
+
+def test_make_gif_frame_order(tmp_path, monkeypatch):
+    # Frames of a file with dashes in its name still go in numeric order
+    import imageio.v2 as imageio
+    from PIL import Image
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("temp")
+    for i in range(12):
+        Image.new("RGB", (8, 8), (i * 20, 0, 0)).save(f"temp/random-1K.bin-{i}.png")
+    gif = n2.make_gif("temp", "random-1K.bin")
+    assert gif == "random-1K.bin.gif"
+    assert [int(frame[0, 0, 0]) for frame in imageio.mimread(gif)] == [i * 20 for i in range(12)]
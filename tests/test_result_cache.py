@@ -0,0 +1,54 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import result_cache
+
+def test_put_get(tmp_path):
+    key = result_cache.cache_key(result_cache.content_hash(b"input"), "key", 1)
+    assert result_cache.cache_get(key, str(tmp_path)) is None
+    result_cache.cache_put(key, b"result", {"name": "out.gif"}, str(tmp_path))
+    assert result_cache.cache_get(key, str(tmp_path)) == (b"result", {"name": "out.gif"})
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+def test_cached_produces_once(tmp_path):
+    calls = []
+    def produce():
+        calls.append(1)
+        return b"result", {}
+    for _ in range(3):
+        assert result_cache.cached("k", produce, str(tmp_path)) == (b"result", {})
+    assert len(calls) == 1
+
+def test_evict_least_recently_used(tmp_path):
+    cache = str(tmp_path)
+    for i, key in enumerate("abc"):
+        result_cache.cache_put(key, bytes(100), cache_dir=cache, max_bytes=1000)
+        os.utime(os.path.join(cache, key + ".bin"), (i, i))
+    # Reading "a" makes "b" the oldest
+    result_cache.cache_get("a", cache)
+    result_cache.cache_put("d", bytes(100), cache_dir=cache, max_bytes=300)
+    assert result_cache.cache_get("b", cache) is None
+    assert all(result_cache.cache_get(key, cache) is not None for key in "acd")
+
+def test_too_big_is_not_stored(tmp_path):
+    result_cache.cache_put("k", bytes(101), cache_dir=str(tmp_path), max_bytes=100)
+    assert result_cache.cache_get("k", str(tmp_path)) is None
+
+def test_evicted_while_reading_is_a_hit(tmp_path, monkeypatch):
+    # Another process evicting the entry between the read and the touch
+    result_cache.cache_put("k", b"result", cache_dir=str(tmp_path))
+    def evicted(path, *args):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(result_cache.os, "utime", evicted)
+    assert result_cache.cache_get("k", str(tmp_path)) == (b"result", {})
+
+def test_default_cache_dir_is_per_user(tmp_path):
+    assert result_cache.default_cache_dir({"XDG_CACHE_HOME": "/home/u/.cache"}) == "/home/u/.cache/hybridcrypt"
+    assert result_cache.default_cache_dir({"HYBRIDCRYPT_CACHE_DIR": "/srv/cache"}) == "/srv/cache"
+    assert result_cache.default_cache_dir({}).startswith(os.path.expanduser("~"))
+
+def test_cache_dir_is_private(tmp_path):
+    cache = str(tmp_path / "cache")
+    result_cache.cache_put("k", b"result", cache_dir=cache)
+    assert os.stat(cache).st_mode & 0o777 == 0o700
@@ -0,0 +1,102 @@
+import http.client
+import json
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import server
+
+@pytest.fixture
+def port(tmp_path):
+    # A server on a free port, as serve() runs it
+    server._reset_metrics(2)
+    server.CodecHandler.workspace = str(tmp_path)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), server.CodecHandler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_port
+    httpd.shutdown()
+    httpd.server_close()
+
+def request(conn, method, path, body=b"", headers=None):
+    conn.request(method, path, body, headers or {})
+    response = conn.getresponse()
+    return response.status, dict(response.getheaders()), response.read()
+
+def test_roundtrip(port):
+    data = os.urandom(20000)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    status, headers, gif = request(conn, "POST", "/encode?name=notes.bin&res=64x48&density=8", data, {"X-Key": "key"})
+    assert status == 200 and headers["Transfer-Encoding"] == "chunked"
+    assert 'filename="notes.bin.gif"' in headers["Content-Disposition"]
+    # The same connection is kept alive for the next request
+    status, headers, recovered = request(conn, "PUT", "/decode", gif, {"X-Key": "key"})
+    assert status == 200 and recovered == data
+    assert 'filename="notes.bin"' in headers["Content-Disposition"]
+
+    status, _, body = request(conn, "GET", "/health")
+    assert status == 200
+    metrics = json.loads(body)
+    assert metrics["requests"] == {"/encode": 1, "/decode": 1}
+    assert metrics["statuses"] == {"200": 2} and metrics["bytes_in"] == len(data) + len(gif)
+
+def test_errors(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    status, _, body = request(conn, "POST", "/encode", b"data")
+    assert status == 400 and "X-Key" in json.loads(body)["error"]
+    status, _, _ = request(conn, "POST", "/encode?density=3", b"data", {"X-Key": "key"})
+    assert status == 400
+    status, _, _ = request(conn, "POST", "/decode", b"not a gif", {"X-Key": "key"})
+    assert status == 400
+    status, _, _ = request(conn, "GET", "/nowhere")
+    assert status == 404
+
+def test_encode_name_is_cleaned(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    status, headers, _ = request(conn, "POST", "/encode?name=a%22b%0D%0AX-Evil:%201.txt", b"data", {"X-Key": "key"})
+    assert status == 200 and "X-Evil" not in headers
+    assert headers["Content-Disposition"] == 'attachment; filename="a_b__X_Evil__1.txt.gif"'
+    status, _, _ = request(conn, "POST", "/encode?name=..", b"data", {"X-Key": "key"})
+    assert status == 400
+
+def test_frame_size_rejected_up_front(port):
+    # Frames too small for the preamble, or wider than GIF allows, are a 400
+    # rather than a 200 cut short
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    for res in ("8x8", "70000x1"):
+        status, _, body = request(conn, "POST", f"/encode?res={res}", b"data", {"X-Key": "key"})
+        assert status == 400, body
+
+def test_unknown_post_route(port):
+    # The first request on the connection; the body is read and dropped and
+    # the connection stays usable
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    status, _, body = request(conn, "POST", "/resize", b"data", {"X-Key": "key"})
+    assert status == 404 and "no such endpoint" in json.loads(body)["error"]
+    status, _, _ = request(conn, "GET", "/health")
+    assert status == 200
+
+def test_slow_uploads_hold_no_slot(port, monkeypatch):
+    # Two clients stalled mid-upload on a two-slot server; a third request
+    # still gets a worker straight away
+    monkeypatch.setattr(server, "QUEUE_TIMEOUT", 0.5)
+    stalled = []
+    for _ in range(2):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        conn.putrequest("POST", "/encode?res=64x48")
+        conn.putheader("X-Key", "key")
+        conn.putheader("Content-Length", "100000")
+        conn.endheaders(b"partial upload")
+        stalled.append(conn)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    status, _, body = request(conn, "GET", "/health")
+    assert status == 200 and json.loads(body)["in_flight"] == 0
+    status, _, _ = request(conn, "POST", "/encode?res=64x48", b"data", {"X-Key": "key"})
+    assert status == 200
+    for conn in stalled:
+        conn.close()